@@ -0,0 +1,190 @@
+import asyncio
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import SpooledTemporaryFile
+
+# ASGI entry point for uvicorn / gunicorn.conf.py.  Flask stays a WSGI app
+# run on a thread pool (ASGI_THREADS), while every async view is awaited on
+# the process's one shared event loop (mistai.shared_loop).  Each in-flight
+# request and each open SSE stream holds one pool thread.
+ASGI_THREADS = int(os.getenv("ASGI_THREADS", "32"))
+DUPLICATE_HEADER_LIMIT = 100
+REQUEST_BODY_MEMORY = 64 * 1024  # larger uploads spill to a temp file
+
+
+class _BadRequest(ValueError):
+    pass
+
+
+class PooledWsgiInstance:
+    """
+    One HTTP request: the body is read on the event loop, then the WSGI app
+    runs in a pool thread and sends its response as it goes.  (asgiref's
+    WsgiToAsgi runs every request on one thread per process.)
+    """
+
+    def __init__(self, wsgi_application, executor):
+        self.wsgi_application = wsgi_application
+        self.executor = executor
+        self.status_line = None  # (status, headers) from start_response
+        self.content_length = None
+        self.headers_sent = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            raise ValueError(f"WSGI bridge got a {scope['type']!r} scope")
+        loop = asyncio.get_running_loop()
+
+        def sync_send(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        with SpooledTemporaryFile(max_size=REQUEST_BODY_MEMORY) as body:
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    return
+                body.write(message.get("body", b""))
+                if not message.get("more_body"):
+                    break
+            body.seek(0)
+            await loop.run_in_executor(
+                self.executor, self.serve, scope, body, sync_send
+            )
+
+    @staticmethod
+    def build_environ(scope, body):
+        script_name = scope.get("root_path", "").encode("utf8").decode("latin1")
+        path_info = scope["path"].encode("utf8").decode("latin1")
+        if path_info.startswith(script_name):
+            path_info = path_info[len(script_name) :]
+        server = scope.get("server") or ("localhost", 80)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": script_name,
+            "PATH_INFO": path_info,
+            "QUERY_STRING": scope["query_string"].decode("ascii"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope['http_version']}",
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": body,
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+        }
+        if scope.get("client"):
+            environ["REMOTE_ADDR"] = scope["client"][0]
+        headers = {}
+        for name, value in scope.get("headers", []):
+            name = name.decode("latin1")
+            if name == "content-length":
+                key = "CONTENT_LENGTH"
+            elif name == "content-type":
+                key = "CONTENT_TYPE"
+            else:
+                key = "HTTP_" + name.upper().replace("-", "_")
+            values = headers.setdefault(key, [])
+            if len(values) >= DUPLICATE_HEADER_LIMIT:
+                raise _BadRequest(f"too many {key} headers")
+            values.append(value.decode("latin1"))
+        environ.update((key, ",".join(values)) for key, values in headers.items())
+        return environ
+
+    def start_response(self, status, response_headers, exc_info=None):
+        if exc_info is not None:
+            if self.headers_sent:
+                raise exc_info[1].with_traceback(exc_info[2])
+        elif self.status_line is not None:
+            raise RuntimeError("start_response called twice without exc_info")
+        headers = [
+            (name.lower().encode("latin1"), value.encode("latin1"))
+            for name, value in response_headers
+        ]
+        self.content_length = None
+        for name, value in response_headers:
+            if name.lower() == "content-length":
+                self.content_length = int(value)
+        self.status_line = (int(status.split(" ", 1)[0]), headers)
+
+    def serve(self, scope, body, sync_send):
+        """Run the WSGI app in a pool thread, sending the response as it goes."""
+
+        def send_headers():
+            if not self.headers_sent:
+                self.headers_sent = True
+                status, headers = self.status_line
+                sync_send(
+                    {
+                        "type": "http.response.start",
+                        "status": status,
+                        "headers": headers,
+                    }
+                )
+
+        try:
+            environ = self.build_environ(scope, body)
+        except _BadRequest:
+            self.start_response("400 Bad Request", [("Content-Type", "text/plain")])
+            send_headers()
+            sync_send({"type": "http.response.body", "body": b"Bad Request"})
+            return
+        output = self.wsgi_application(environ, self.start_response)
+        try:
+            sent = 0
+            for chunk in output:
+                send_headers()
+                limit = self.content_length
+                if limit is not None:
+                    chunk = chunk[: limit - sent]
+                sync_send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+                sent += len(chunk)
+                if sent == limit:
+                    break
+        finally:
+            if hasattr(output, "close"):
+                output.close()  # WSGI: lets streamed responses clean up
+        send_headers()
+        sync_send({"type": "http.response.body"})
+
+
+class PooledWsgiToAsgi:
+    def __init__(self, wsgi_application, threads):
+        self.wsgi_application = wsgi_application
+        self.threads = threads
+        self._executor = None
+
+    @property
+    def executor(self):
+        # Built on first request, i.e. in the worker after gunicorn forks
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                self.threads, thread_name_prefix="mistai-wsgi"
+            )
+        return self._executor
+
+    async def __call__(self, scope, receive, send):
+        await PooledWsgiInstance(self.wsgi_application, self.executor)(
+            scope, receive, send
+        )
+
+
+# Extraction workers re-run the main script as __mp_main__ (mistai.get_extract_pool)
+if __name__ != "__mp_main__":
+    from mistai import app
+
+    application = PooledWsgiToAsgi(app, ASGI_THREADS)
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        application,
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", 5000)),
+        lifespan="off",
+    )
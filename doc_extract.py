@@ -0,0 +1,86 @@
+# ─────────────────────
+# Document text extraction for Mist.AI uploads.
+#
+# Runs inside the extraction process pool.  PyMuPDF and python-docx are
+# imported lazily so they only ever load in the pool workers, never in the
+# web process.
+# ─────────────────────
+import io
+import json
+
+TRUNCATED_NOTE = "\n\n⚠️ File truncated — only the first part was read."
+
+
+def _finish(parts, max_chars, truncated):
+    text = "\n".join(parts)
+    if len(text) > max_chars:
+        text, truncated = text[:max_chars], True
+    text = text.strip()
+    if not text:
+        return "⚠️ No readable text found."
+    return text + TRUNCATED_NOTE if truncated else text
+
+
+def extract_text_from_pdf(file_content, max_pages, max_chars):
+    import fitz  # PyMuPDF
+
+    try:
+        parts, total, truncated = [], 0, False
+        with fitz.open("pdf", file_content) as doc:
+            # Pages are loaded one at a time, so stopping early skips the rest
+            for number, page in enumerate(doc):
+                if number >= max_pages or total >= max_chars:
+                    truncated = True
+                    break
+                text = page.get_text()
+                parts.append(text)
+                total += len(text) + 1
+        return _finish(parts, max_chars, truncated)
+    except Exception as e:
+        return f"⚠️ Error extracting text: {str(e)}"
+
+
+def process_txt(file_content, max_pages, max_chars):
+    text = file_content[: max_chars * 4].decode("utf-8", errors="ignore")
+    truncated = len(text) > max_chars or len(file_content) > max_chars * 4
+    return text[:max_chars] + TRUNCATED_NOTE if truncated else text
+
+
+def process_json(file_content, max_pages, max_chars):
+    try:
+        pretty = json.dumps(json.loads(file_content.decode("utf-8")), indent=4)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        return "⚠️ Invalid JSON file."
+    if len(pretty) > max_chars:
+        return pretty[:max_chars] + TRUNCATED_NOTE
+    return pretty
+
+
+def process_docx(file_content, max_pages, max_chars):
+    from docx import Document
+
+    try:
+        doc = Document(io.BytesIO(file_content))
+        parts, total, truncated = [], 0, False
+        for paragraph in doc.paragraphs:
+            if total >= max_chars:
+                truncated = True
+                break
+            parts.append(paragraph.text)
+            total += len(paragraph.text) + 1
+        return _finish(parts, max_chars, truncated)
+    except Exception as e:
+        return f"⚠️ Error reading .docx: {str(e)}"
+
+
+PROCESSORS = {
+    ".pdf": extract_text_from_pdf,
+    ".txt": process_txt,
+    ".json": process_json,
+    ".docx": process_docx,
+    ".doc": process_docx,
+}
+
+
+def extract(ext, file_content, max_pages, max_chars):
+    return PROCESSORS[ext](file_content, max_pages, max_chars)
@@ -0,0 +1,56 @@
+# Production launcher: gunicorn -c gunicorn.conf.py asgi:application
+import multiprocessing
+import os
+import tempfile
+
+# Must be set before mistai (and prometheus_client) are imported below.
+os.environ["MISTAI_DEFER_STARTUP"] = "1"
+os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="mistai-metrics-")
+)
+
+# fly.toml internal_port; not $PORT, which the Dockerfile sets to 8080
+bind = "0.0.0.0:5000"
+worker_class = "uvicorn_worker.UvicornWorker"
+# Concurrency within a worker comes from asgi.ASGI_THREADS request threads
+# waiting on the shared event loop.  Several workers split state that lives
+# in process memory — down mode and circuit breakers, ip_log, upload
+# statuses, weather_last_city — so /admin and /api/status would report
+# whichever worker answered.  One worker by default; WEB_CONCURRENCY opts
+# into more (by CPU, capped by MAX_WORKERS) with that state per process.
+max_workers = int(os.getenv("MAX_WORKERS", "4"))
+if os.getenv("WEB_CONCURRENCY") == "auto":
+    workers = min(multiprocessing.cpu_count(), max_workers)
+else:
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+preload_app = True  # import once in the master; workers share pages copy-on-write
+timeout = 120  # long model calls and SSE streams
+graceful_timeout = 30
+keepalive = 75  # longer than Fly's proxy idle timeout
+
+
+def when_ready(server):
+    """Master, app preloaded, before the first fork."""
+    from prometheus_client import CollectorRegistry, multiprocess, start_http_server
+
+    import mistai
+
+    # Heavy SDK modules go in the shared pages too; clients are built per worker
+    mistai.preload_sdk_modules()
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    start_http_server(mistai.METRICS_PORT, registry=registry)
+    server.log.info(f"Metrics for all workers on :{mistai.METRICS_PORT}/metrics")
+
+
+def post_fork(server, worker):
+    import mistai
+
+    mistai.startup()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
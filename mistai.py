@@ -8,15 +8,30 @@ import re
 import json
 import time
 import base64
+import bisect
+import gzip
+import shutil
 import random
+import tempfile
+import uuid
 import logging
 import asyncio
 import sqlite3
 import threading
+import contextvars
+import atexit
+import multiprocessing
 import queue as queue_module
+import heapq
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 from functools import wraps
+from contextlib import contextmanager
 import hashlib
+import zlib
 
 # ─────────────────────
 # Flask & Web
@@ -31,8 +46,10 @@ from flask import (
     session,
     flash,
     make_response,
-    send_from_directory,
     after_this_request,
+    Response,
+    g,
+    has_request_context,
 )
 from flask_cors import CORS
 from werkzeug.exceptions import NotFound
@@ -41,28 +58,27 @@ from werkzeug.exceptions import NotFound
 # Environment & HTTP
 # ─────────────────────
 from dotenv import load_dotenv
-import requests
 import httpx
 import pytz
 
 # ─────────────────────
-# AI / LLM APIs
+# Metrics
 # ─────────────────────
-import google.generativeai as genai
-import cohere
-from tavily import TavilyClient
+from prometheus_client import Counter, Gauge, Histogram, REGISTRY, start_http_server
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 
 # ─────────────────────
 # File & Document Processing
 # ─────────────────────
-import fitz  # PyMuPDF
-from docx import Document
+import doc_extract  # PyMuPDF / python-docx load inside the extraction workers
 
 # ─────────────────────
 # Math / Parsing
 # ─────────────────────
-import sympy
-from sympy.parsing.mathematica import parse_mathematica
+import numpy as np
+
+# google-generativeai, cohere, tavily and sympy are imported on first use —
+# see "Lazy SDK Clients" below.
 
 # ─────────────────────
 load_dotenv()
@@ -81,7 +97,84 @@ if (
 ):
     raise ValueError("Missing required API keys in environment variables.")
 
-app = Flask(
+
+# =========================
+# Shared Event Loop
+# =========================
+# asyncio.to_thread runs on the loop's default executor, which would be
+# min(32, cpu + 4) threads — 5 on a 1-CPU VM.  Every blocking provider call,
+# integration call and losing hedge holds one until it returns.
+UPSTREAM_THREADS = int(os.getenv("MISTAI_UPSTREAM_THREADS", "32"))
+
+
+class SharedEventLoop:
+    """
+    One long-lived event loop per process, on its own thread.  Async views
+    run here instead of on a fresh loop per request, so loop-bound state
+    survives between requests and any number of requests can be awaiting
+    upstreams at once.  Started lazily — i.e. after a gunicorn fork.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        if self._loop is None:
+            with self._lock:
+                if self._loop is None:
+                    loop = asyncio.new_event_loop()
+                    loop.set_default_executor(
+                        ThreadPoolExecutor(
+                            UPSTREAM_THREADS, thread_name_prefix="mistai-upstream"
+                        )
+                    )
+                    self._thread = threading.Thread(
+                        target=loop.run_forever, name="mistai-loop", daemon=True
+                    )
+                    self._thread.start()
+                    self._loop = loop
+        return self._loop
+
+    def run(self, coro):
+        """Run `coro` on the loop from a sync thread, in that thread's context."""
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("SharedEventLoop.run() called from the loop itself")
+        context = contextvars.copy_context()  # carries Flask's request context
+        result = Future()
+
+        def relay(task):
+            if task.cancelled():
+                result.cancel()
+            elif task.exception() is not None:
+                result.set_exception(task.exception())
+            else:
+                result.set_result(task.result())
+
+        def start():
+            self.loop.create_task(coro, context=context).add_done_callback(relay)
+
+        self.loop.call_soon_threadsafe(start)
+        return result.result()
+
+
+shared_loop = SharedEventLoop()
+
+
+class MistaiFlask(Flask):
+    def async_to_sync(self, func):
+        # Flask's default (asgiref) builds a new event loop for every call
+        @wraps(func)
+        def run(*args, **kwargs):
+            return shared_loop.run(func(*args, **kwargs))
+
+        return run
+
+
+app = MistaiFlask(
     __name__, template_folder="templates", static_folder="static", static_url_path=""
 )
 
@@ -162,6 +255,7 @@ def log_err(msg):   log.error(f"❌ {msg}")
 def log_ok(msg):    log.info(f"✅ {msg}")
 def log_search(msg): log.info(f"🔍 {msg}")
 def log_router(decision): log.info(f"🧭 Tavily → {decision}")
+def log_timing(record): log.info(f"⏱️ {json.dumps(record)}")
 
 app.logger.handlers.clear()
 app.logger.addHandler(_handler)
@@ -178,7 +272,398 @@ LOG_DIR = (
     "/app/data" if os.path.exists("/app/data") else os.path.join(os.getcwd(), "data")
 )
 os.makedirs(LOG_DIR, exist_ok=True)
-LOG_FILE = os.path.join(LOG_DIR, "chat_logs.json")
+LOG_FILE = os.path.join(LOG_DIR, "chat_logs.json")  # legacy single-file log
+LOG_SEGMENT_DIR = os.path.join(LOG_DIR, "chat_logs")
+LOG_SEGMENT_MAX_BYTES = 4 * 1024 * 1024
+LOG_SEGMENT_MAX_AGE = 24 * 60 * 60  # seconds
+LOG_GZIP_CLOSED_SEGMENTS = os.getenv("CHAT_LOG_GZIP", "true").lower() == "true"
+# The admin viewer indexes only the newest segments (each up to 4MB / 24h)
+LOG_INDEX_MAX_SEGMENTS = int(os.getenv("CHAT_LOG_INDEX_SEGMENTS", "14"))
+
+
+class ChatLogStore:
+    """
+    Append-only JSON-lines chat log split into segments.
+
+    Each process appends to its own active segment
+    (`chat-<started>-<pid>-<seq>.jsonl`), so a flush costs O(batch) instead of
+    re-reading and rewriting the whole history.  Once the active segment
+    passes max_bytes or max_age it is closed and, optionally, gzipped.
+    Segment names sort chronologically.
+    """
+
+    def __init__(self, directory, max_bytes, max_age, gzip_closed):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.gzip_closed = gzip_closed
+        self._lock = threading.Lock()
+        self._active = None
+        self._active_started = 0.0
+        self._seq = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def append_many(self, entries):
+        data = "".join(
+            json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries
+        ).encode("utf-8")
+        with self._lock:
+            if self._active and time.time() - self._active_started >= self.max_age:
+                self._rotate()
+            if not self._active:
+                self._active_started = time.time()
+                stamp = time.strftime(
+                    "%Y%m%dT%H%M%S", time.gmtime(self._active_started)
+                )
+                self._seq += 1
+                self._active = os.path.join(
+                    self.directory, f"chat-{stamp}-{os.getpid()}-{self._seq:04d}.jsonl"
+                )
+            with open(self._active, "ab") as f:
+                f.write(data)
+                size = f.tell()
+            if size >= self.max_bytes:
+                self._rotate()
+
+    def _rotate(self):
+        closed, self._active = self._active, None
+        if closed and self.gzip_closed:
+            self._compress(closed)
+
+    @staticmethod
+    def _compress(path):
+        # Every worker sweeps stale segments at startup; a per-process temp
+        # file keeps two of them compressing the same segment from colliding.
+        tmp = f"{path}.{os.getpid()}.gz.tmp"
+        try:
+            with open(path, "rb") as src, gzip.open(tmp, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(tmp, path + ".gz")
+            os.remove(path)
+        except FileNotFoundError:
+            # another worker finished first
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        except Exception as e:
+            log_warn(f"⚠️ Failed to compress log segment {path}: {e}")
+
+    def segments(self):
+        """Segment paths, oldest first."""
+        names = [
+            n
+            for n in os.listdir(self.directory)
+            if n.startswith("chat-")
+            and (n.endswith(".jsonl") or n.endswith(".jsonl.gz"))
+        ]
+        return [os.path.join(self.directory, n) for n in sorted(names)]
+
+    @staticmethod
+    def open_segment(path):
+        if path.endswith(".gz"):
+            return gzip.open(path, "rb")
+        return open(path, "rb")
+
+    def iter_entries(self):
+        for path in self.segments():
+            try:
+                with self.open_segment(path) as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        try:
+                            yield json.loads(line)
+                        except ValueError:
+                            continue  # torn write from a crash — skip the line
+            except FileNotFoundError:
+                continue  # rotated/compressed while we were listing
+
+    def close_stale_segments(self):
+        """Compress plain segments left behind by processes that are gone."""
+        if not self.gzip_closed:
+            return
+        with self._lock:
+            for path in self.segments():
+                if not path.endswith(".jsonl") or path == self._active:
+                    continue
+                pid = os.path.basename(path).split("-")[2]
+                if pid.isdigit() and int(pid) != os.getpid() and _pid_alive(int(pid)):
+                    continue
+                self._compress(path)
+
+    def import_legacy(self, legacy_file):
+        """One-time migration of the old {"logs": [...]} chat_logs.json."""
+        claimed = self._claim_legacy(legacy_file)
+        if claimed is None:
+            return
+        try:
+            with open(claimed, "r", encoding="utf-8") as f:
+                content = f.read().strip()
+            logs = json.loads(content).get("logs", []) if content else []
+            if logs:
+                path = os.path.join(self.directory, "chat-00000000T000000-legacy.jsonl")
+                with open(path, "w", encoding="utf-8") as f:
+                    for entry in logs:
+                        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                if self.gzip_closed:
+                    self._compress(path)
+            os.replace(claimed, legacy_file + ".migrated")
+            log_ok(f"Migrated {len(logs)} legacy chat log entries")
+        except Exception as e:
+            log_warn(f"⚠️ Legacy chat log migration failed (non-fatal): {e}")
+
+    @staticmethod
+    def _claim_legacy(legacy_file):
+        """
+        Rename the legacy file to `<name>.importing-<pid>` so exactly one
+        worker imports it.  A claim left by a dead process is taken over.
+        """
+        claimed = f"{legacy_file}.importing-{os.getpid()}"
+        prefix = os.path.basename(legacy_file) + ".importing-"
+        folder = os.path.dirname(legacy_file) or "."
+        candidates = [legacy_file] + [
+            os.path.join(folder, n)
+            for n in os.listdir(folder)
+            if n.startswith(prefix)
+            and n[len(prefix):].isdigit()
+            and not _pid_alive(int(n[len(prefix):]))
+        ]
+        for path in candidates:
+            try:
+                os.rename(path, claimed)
+                return claimed
+            except FileNotFoundError:
+                continue  # another worker claimed it first
+        return None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class LogIndexEntry:
+    __slots__ = ("offset", "timestamp", "ip", "model", "grounded")
+
+    def __init__(self, offset, timestamp, ip, model, grounded):
+        self.offset = offset
+        self.timestamp = timestamp
+        self.ip = ip
+        self.model = model
+        self.grounded = grounded
+
+
+class ChatLogIndex:
+    """
+    In-memory index over the newest `max_segments` chat log segments:
+    (time, ip, model, grounded) plus the byte offset of every line, so the
+    admin viewer can filter and page without loading whole segments.  Built
+    on the first page() call, not at startup.  refresh() is incremental — it
+    only scans bytes appended since the last call, including segments written
+    by other worker processes.  Offsets survive gzip rotation because they
+    point into the uncompressed stream.
+    """
+
+    def __init__(self, store, max_segments):
+        self.store = store
+        self.max_segments = max_segments
+        self._segments = {}  # segment id -> [LogIndexEntry] in (time, offset) order
+        self._scanned = {}  # segment id -> bytes indexed so far
+        self._closed = set()  # ids whose .gz has been fully indexed
+        self._gz_cache = OrderedDict()  # segment id -> decompressed bytes
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def segment_id(path):
+        name = os.path.basename(path)
+        return name[: -len(".gz")] if name.endswith(".gz") else name
+
+    def _paths(self):
+        """segment id -> path for the segments the index covers."""
+        newest = self.store.segments()[-self.max_segments :]
+        return {self.segment_id(p): p for p in newest}
+
+    def refresh(self):
+        with self._lock:
+            paths = self._paths()
+            for seg_id in list(self._segments):
+                if seg_id not in paths:
+                    self._forget(seg_id)
+            for seg_id, path in paths.items():
+                if seg_id in self._closed:
+                    continue
+                try:
+                    self._scan(seg_id, path)
+                except FileNotFoundError:
+                    continue  # rotated mid-scan; picked up as .gz next time
+
+    def _forget(self, seg_id):
+        self._segments.pop(seg_id, None)
+        self._scanned.pop(seg_id, None)
+        self._closed.discard(seg_id)
+        self._gz_cache.pop(seg_id, None)
+
+    def _scan(self, seg_id, path):
+        scanned = self._scanned.get(seg_id, 0)
+        if path.endswith(".gz"):
+            data = self._read_gz(seg_id, path)
+            base, pos = 0, scanned
+            self._closed.add(seg_id)
+        else:
+            if os.path.getsize(path) <= scanned:
+                return
+            with open(path, "rb") as f:
+                f.seek(scanned)
+                data = f.read()
+            base, pos = scanned, 0
+        entries = self._segments.setdefault(seg_id, [])
+        while True:
+            # only index complete lines; a partial one is finished next time
+            nl = data.find(b"\n", pos)
+            if nl == -1:
+                break
+            line, offset, pos = data[pos:nl], base + pos, nl + 1
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            # kept in (time, offset) order; lines are appended almost sorted
+            bisect.insort(
+                entries,
+                LogIndexEntry(
+                    offset,
+                    str(entry.get("timestamp", "")),
+                    entry.get("ip"),
+                    entry.get("model"),
+                    bool(entry.get("grounded")),
+                ),
+                key=_index_order,
+            )
+        self._scanned[seg_id] = base + pos
+
+    def _read_gz(self, seg_id, path):
+        data = self._gz_cache.get(seg_id)
+        if data is None:
+            with gzip.open(path, "rb") as f:
+                data = f.read()
+            self._gz_cache[seg_id] = data
+            while len(self._gz_cache) > 2:
+                self._gz_cache.popitem(last=False)
+        else:
+            self._gz_cache.move_to_end(seg_id)
+        return data
+
+    def _read_line(self, seg_id, offset, path):
+        if path.endswith(".gz"):
+            data = self._read_gz(seg_id, path)
+            return data[offset : data.find(b"\n", offset)]
+        with open(path, "rb") as f:
+            f.seek(offset)
+            return f.readline()
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._segments.values())
+
+    def _newest_first(self, seg_id, after):
+        """Segment entries strictly before the cursor key, newest first."""
+        entries = self._segments[seg_id]
+        hi = len(entries)
+        if after is not None:
+            after_ts, after_seg, after_offset = after
+            # (time, segment, offset) < after, within a single segment
+            if seg_id < after_seg:
+                hi = bisect.bisect_right(
+                    entries, (after_ts, float("inf")), key=_index_order
+                )
+            elif seg_id > after_seg:
+                hi = bisect.bisect_left(entries, (after_ts, -1), key=_index_order)
+            else:
+                hi = bisect.bisect_left(
+                    entries, (after_ts, after_offset), key=_index_order
+                )
+        for item in reversed(entries[:hi]):
+            yield (item.timestamp, seg_id, item.offset), item
+
+    def page(
+        self,
+        cursor=None,
+        limit=50,
+        ip=None,
+        model=None,
+        grounded=None,
+        since=None,
+        until=None,
+    ):
+        """
+        Newest-first page of log entries matching the filters, merged across
+        segments (every worker writes its own) by entry time.
+        `cursor` is the opaque "next_cursor" of the previous page; since/until
+        are ISO timestamps (or date prefixes) compared against entry time.
+        Returns (entries, next_cursor).
+        """
+        self.refresh()
+        after = None
+        if cursor:
+            after_ts, after_seg, after_offset = cursor.rsplit("|", 2)
+            after = (after_ts, after_seg, int(after_offset))
+
+        matches = []
+        with self._lock:
+            paths = self._paths()
+            merged = heapq.merge(
+                *(self._newest_first(seg_id, after) for seg_id in self._segments),
+                key=lambda pair: pair[0],
+                reverse=True,
+            )
+            for key, item in merged:
+                if ip and item.ip != ip:
+                    continue
+                if model and item.model != model:
+                    continue
+                if grounded is not None and item.grounded != grounded:
+                    continue
+                if since and item.timestamp < since:
+                    continue
+                if until and item.timestamp[: len(until)] > until:
+                    continue
+                matches.append((key, item))
+                if len(matches) > limit:
+                    break
+
+            has_more = len(matches) > limit
+            matches = matches[:limit]
+            results = []
+            for (_, seg_id, _), item in matches:
+                try:
+                    line = self._read_line(seg_id, item.offset, paths[seg_id])
+                    results.append(json.loads(line))
+                except (KeyError, OSError, ValueError):
+                    continue  # segment rotated/removed since the scan
+
+        next_cursor = None
+        if has_more and matches:
+            timestamp, seg_id, offset = matches[-1][0]
+            next_cursor = f"{timestamp}|{seg_id}|{offset}"
+        return results, next_cursor
+
+
+def _index_order(entry):
+    return (entry.timestamp, entry.offset)
+
+
+chat_log_store = ChatLogStore(
+    LOG_SEGMENT_DIR,
+    LOG_SEGMENT_MAX_BYTES,
+    LOG_SEGMENT_MAX_AGE,
+    LOG_GZIP_CLOSED_SEGMENTS,
+)
+chat_log_index = ChatLogIndex(chat_log_store, LOG_INDEX_MAX_SEGMENTS)
 
 log_queue = queue_module.Queue()
 log_thread_running = False
@@ -215,26 +700,7 @@ def _log_writer_thread():
 
             if should_flush and batch:
                 try:
-                    logs = {"logs": []}
-                    if os.path.exists(LOG_FILE):
-                        try:
-                            with open(LOG_FILE, "r", encoding="utf-8") as f:
-                                content = f.read().strip()
-                                if content:
-                                    parsed = json.loads(content)
-                                    if isinstance(parsed, dict) and "logs" in parsed:
-                                        logs = parsed
-                        except Exception:
-                            pass  # corrupt file → start fresh
-
-                    for entry in batch:
-                        logs["logs"].append(entry)
-
-                    tmp = LOG_FILE + ".tmp"
-                    with open(tmp, "w", encoding="utf-8") as f:
-                        json.dump(logs, f, indent=2)
-                    os.replace(tmp, LOG_FILE)
-
+                    chat_log_store.append_many(batch)
                     batch = []
                     last_write = current_time
                 except Exception as e:
@@ -243,7 +709,16 @@ def _log_writer_thread():
             log_warn(f"⚠️ Log writer thread error: {e}")
 
 
-def safe_log_chat(user_ip, model_choice, message, response, grounded):
+def safe_log_chat(
+    user_ip,
+    model_choice,
+    message,
+    response,
+    grounded,
+    timings=None,
+    template=None,
+    router=None,
+):
     """Queue a chat log entry for batched writing. Never raises."""
     try:
         entry = {
@@ -254,22 +729,486 @@ def safe_log_chat(user_ip, model_choice, message, response, grounded):
             "response": response[:800],
             "grounded": grounded,
         }
+        if timings:
+            entry["timings"] = timings  # per-stage milliseconds
+        if template:
+            entry["template"] = template  # extension prompt template id
+        if router:
+            entry["router"] = router  # {"decision", "source", "score"}
         log_queue.put(entry, block=False)
     except Exception as e:
         log_warn(f"⚠️ Failed to queue log entry: {e}")
 
 
+# =========================
+# Metrics
+# =========================
+# Prometheus text endpoint on the port fly.toml scrapes ([metrics] 9090).
+# Counters/histograms are updated inline; sizes of in-memory structures are
+# read at scrape time by MistaiCollector so nothing has to keep them current.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9090"))
+METRIC_ROUTES = {"/chat", "/api/chat", "/tavily", "/time-news"}
+
+REQUEST_COUNT = Counter(
+    "mistai_requests_total", "HTTP requests", ["route", "method", "status"]
+)
+REQUEST_LATENCY = Histogram(
+    "mistai_request_duration_seconds",
+    "Time until the response body has been sent",
+    ["route"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+)
+UPSTREAM_LATENCY = Histogram(
+    "mistai_upstream_latency_seconds",
+    "Model provider and integration call latency (streams: time to first token)",
+    ["upstream"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+)
+UPSTREAM_ERRORS = Counter(
+    "mistai_upstream_errors_total", "Failed provider/integration calls", ["upstream"]
+)
+ROUTER_DECISIONS = Counter(
+    "mistai_router_decisions_total",
+    "Tavily routing decisions",
+    ["decision", "source"],  # source: heuristic | cache | local | model | error
+)
+PROMPT_TEMPLATES_SEEN = Counter(
+    "mistai_prompt_templates_total",
+    "Chat messages by extension prompt template (chat = none)",
+    ["template"],
+)
+
+
+class MistaiCollector:
+    """Scrape-time gauges for caches, queues and in-memory logs."""
+
+    def describe(self):
+        # Keeps register() from calling collect() before the caches exist
+        return []
+
+    def collect(self):
+        hits = CounterMetricFamily(
+            "mistai_cache_hits", "Cache hits (near hits included)", labels=["cache"]
+        )
+        misses = CounterMetricFamily(
+            "mistai_cache_misses", "Cache misses", labels=["cache"]
+        )
+        ratio = GaugeMetricFamily(
+            "mistai_cache_hit_ratio", "Cache hit ratio", labels=["cache"]
+        )
+        entries = GaugeMetricFamily(
+            "mistai_cache_entries", "Cache entries", labels=["cache"]
+        )
+        for stats in (
+            tavily_router_cache.stats(),
+            tavily_cache.stats(),
+            grounding_store.stats(),
+            response_cache.stats(),
+            weather_geo_cache.stats(),
+            weather_forecast_cache.stats(),
+            weather_last_city.stats(),
+        ):
+            name = stats["name"]
+            hits.add_metric([name], stats["hits"] + stats.get("near_hits", 0))
+            misses.add_metric([name], stats["misses"])
+            ratio.add_metric([name], stats["hit_ratio"] or 0.0)
+            entries.add_metric([name], stats["entries"])
+        yield from (hits, misses, ratio, entries)
+
+        yield GaugeMetricFamily(
+            "mistai_log_queue_depth",
+            "Chat log entries waiting to be flushed",
+            value=log_queue.qsize(),
+        )
+        yield GaugeMetricFamily(
+            "mistai_upload_queue_depth",
+            "GoFile uploads waiting",
+            value=upload_queue.depth(),
+        )
+        yield GaugeMetricFamily(
+            "mistai_ip_log_ips", "IPs tracked in ip_log", value=len(ip_log)
+        )
+        yield GaugeMetricFamily(
+            "mistai_ip_log_messages",
+            "Messages held in ip_log",
+            value=ip_log.total_messages(),
+        )
+        yield GaugeMetricFamily(
+            "mistai_chat_log_index_entries",
+            "Indexed chat log entries",
+            value=len(chat_log_index),
+        )
+        yield GaugeMetricFamily(
+            "mistai_is_down", "Global down mode", value=int(IS_DOWN)
+        )
+
+        age = GaugeMetricFamily(
+            "mistai_context_age_seconds",
+            "Age of the last good value of each background context source",
+            labels=["source"],
+        )
+        for name, source in context_scheduler.sources.items():
+            if source.updated_at is not None:
+                age.add_metric([name], source.age())
+        yield age
+
+
+REGISTRY.register(MistaiCollector())
+
+
+# Under gunicorn.conf.py every worker writes to PROMETHEUS_MULTIPROC_DIR and
+# the master serves the merged view.  Scrape-time collectors don't work
+# there, so each worker copies MistaiCollector's values into live gauges.
+METRICS_MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+METRICS_GAUGE_REFRESH = 15  # seconds
+_multiprocess_gauges = {}
+
+
+def _multiprocess_gauge(sample, documentation):
+    gauge = _multiprocess_gauges.get(sample.name)
+    if gauge is None:
+        if sample.name.endswith("_ratio"):
+            mode = "liveall"  # per worker; ratios don't add up
+        elif sample.name == "mistai_is_down":
+            mode = "livemax"
+        else:
+            mode = "livesum"
+        gauge = _multiprocess_gauges[sample.name] = Gauge(
+            sample.name,
+            documentation,
+            list(sample.labels),
+            multiprocess_mode=mode,
+        )
+    return gauge
+
+
+def _refresh_multiprocess_gauges():
+    collector = MistaiCollector()
+    while True:
+        try:
+            for family in collector.collect():
+                for sample in family.samples:
+                    gauge = _multiprocess_gauge(sample, family.documentation)
+                    if sample.labels:
+                        gauge = gauge.labels(**sample.labels)
+                    gauge.set(sample.value)
+        except Exception as e:
+            log_warn(f"⚠️ Metrics gauge refresh failed: {e}")
+        time.sleep(METRICS_GAUGE_REFRESH)
+
+
+def start_metrics_server():
+    if METRICS_MULTIPROCESS:
+        threading.Thread(target=_refresh_multiprocess_gauges, daemon=True).start()
+        return
+    try:
+        start_http_server(METRICS_PORT)
+        log_ok(f"Metrics on :{METRICS_PORT}/metrics")
+    except OSError as e:
+        # Port already taken (another process) — don't crash startup
+        log_warn(f"⚠️ Metrics server not started on :{METRICS_PORT}: {e}")
+
+
+@app.before_request
+def before_request_metrics():
+    request.environ["mistai.started"] = time.monotonic()
+
+
+@app.after_request
+def after_request_metrics(response):
+    route = request.path
+    if route not in METRIC_ROUTES:
+        return response
+    started = request.environ.get("mistai.started", time.monotonic())
+    REQUEST_COUNT.labels(route, request.method, str(response.status_code)).inc()
+    # Streaming replies finish long after this hook — observe on close
+    response.call_on_close(
+        lambda: REQUEST_LATENCY.labels(route).observe(time.monotonic() - started)
+    )
+    return response
+
+
+# =========================
+# Stage Timing
+# =========================
+# Per-request spans ("router", "grounding", "model", ...) collected on
+# flask.g.  They leave as a Server-Timing header for browser devtools, one
+# "⏱️" JSON log line per request, a `timings` field on the chat log entry
+# and the mistai_stage_duration_seconds histogram.
+STAGE_LATENCY = Histogram(
+    "mistai_stage_duration_seconds",
+    "Time spent per request stage",
+    ["stage"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60),
+)
+
+
+class StageTimer:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.stages = {}  # stage -> seconds, in first-seen order
+
+    def add(self, stage, seconds):
+        # Repeated stages (two weather calls, a retried fetch) accumulate
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        STAGE_LATENCY.labels(stage).observe(seconds)
+
+    @contextmanager
+    def span(self, stage):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(stage, time.monotonic() - started)
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def as_dict(self):
+        """Stage durations in milliseconds."""
+        return {stage: round(s * 1000, 1) for stage, s in self.stages.items()}
+
+    def server_timing(self):
+        parts = [f"{stage};dur={ms}" for stage, ms in self.as_dict().items()]
+        parts.append(f"total;dur={round(self.elapsed() * 1000, 1)}")
+        return ", ".join(parts)
+
+
+def request_timer():
+    """The current request's StageTimer (a throwaway one outside requests)."""
+    if not has_request_context():
+        return StageTimer()
+    if "timer" not in g:
+        g.timer = StageTimer()
+    return g.timer
+
+
+def span(stage):
+    return request_timer().span(stage)
+
+
+async def timed(stage, awaitable):
+    with span(stage):
+        return await awaitable
+
+
+@app.before_request
+def before_request_timer():
+    g.timer = StageTimer()
+
+
+@app.after_request
+def after_request_timer(response):
+    timer = g.get("timer")
+    if timer is None or not timer.stages:
+        return response
+    response.headers["Server-Timing"] = timer.server_timing()
+    route, status_code = request.path, response.status_code
+
+    # On close, so a streamed model call is part of the record
+    def log_record():
+        log_timing(
+            {
+                "route": route,
+                "status": status_code,
+                "total_ms": round(timer.elapsed() * 1000, 1),
+                "stages": timer.as_dict(),
+            }
+        )
+
+    response.call_on_close(log_record)
+    return response
+
+
+# =========================
+# Circuit Breakers
+# =========================
+# One breaker per model provider and per outside integration.  A breaker
+# opens when too many recent calls failed or ran slow, rejects calls while
+# it cools down, then lets a single probe through (half-open): success closes
+# it again, failure re-opens it.
+class CircuitOpenError(Exception):
+    def __init__(self, name):
+        super().__init__(f"{name} circuit is open")
+        self.name = name
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name,
+        slow_call_seconds,
+        window=20,
+        min_calls=5,
+        failure_rate=0.5,
+        slow_rate=0.8,
+        cooldown=30.0,
+    ):
+        self.name = name
+        self.slow_call_seconds = slow_call_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_rate = slow_rate
+        self.cooldown = cooldown
+        self._calls = deque(maxlen=window)  # (ok, slow)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe = None  # ticket of the call probing a half-open circuit
+        self._lock = threading.Lock()
+
+    def _current_state(self):
+        if (
+            self._state == self.OPEN
+            and time.monotonic() - self._opened_at >= self.cooldown
+        ):
+            self._state = self.HALF_OPEN
+            self._probe = None
+        return self._state
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def allow(self):
+        """
+        Claim permission for one call: a (truthy) ticket, or None if the
+        circuit is open.  Pair with record(), or release(ticket).
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and self._probe is None:
+                self._probe = object()
+                return self._probe
+            return None
+
+    def release(self, ticket):
+        """Give back a claimed call that never produced an outcome."""
+        with self._lock:
+            # only the probe's own ticket frees the half-open slot
+            if ticket is self._probe:
+                self._probe = None
+
+    def _rates(self):
+        total = len(self._calls)
+        if not total:
+            return 0.0, 0.0
+        failures = sum(1 for ok, _ in self._calls if not ok)
+        slow = sum(1 for _, slow in self._calls if slow)
+        return failures / total, slow / total
+
+    def _open(self, why):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probe = None
+        log_warn(f"⚠️ {self.name} circuit OPEN ({why}) for {self.cooldown:.0f}s")
+
+    def record(self, ok, seconds):
+        UPSTREAM_LATENCY.labels(self.name).observe(seconds)
+        if not ok:
+            UPSTREAM_ERRORS.labels(self.name).inc()
+        slow = seconds >= self.slow_call_seconds
+        with self._lock:
+            if self._current_state() == self.HALF_OPEN:
+                if ok and not slow:
+                    self._state = self.CLOSED
+                    self._calls.clear()
+                    self._probe = None
+                    log_ok(f"{self.name} circuit closed — probe succeeded")
+                else:
+                    self._open("probe failed" if not ok else "probe too slow")
+                return
+            self._calls.append((ok, slow))
+            if self._state != self.CLOSED or len(self._calls) < self.min_calls:
+                return
+            failure_rate, slow_rate = self._rates()
+            if failure_rate >= self.failure_rate:
+                self._open(f"{failure_rate:.0%} errors")
+            elif slow_rate >= self.slow_rate:
+                self._open(f"{slow_rate:.0%} slower than {self.slow_call_seconds}s")
+
+    async def call(self, awaitable):
+        """Await `awaitable` under this breaker; raises CircuitOpenError if open."""
+        ticket = self.allow()
+        if not ticket:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise CircuitOpenError(self.name)
+        started = time.monotonic()
+        try:
+            result = await awaitable
+        except asyncio.CancelledError:
+            self.release(ticket)
+            raise
+        except Exception:
+            self.record(False, time.monotonic() - started)
+            raise
+        self.record(True, time.monotonic() - started)
+        return result
+
+    def snapshot(self):
+        with self._lock:
+            state = self._current_state()
+            failure_rate, slow_rate = self._rates()
+            retry_in = (
+                max(self.cooldown - (time.monotonic() - self._opened_at), 0.0)
+                if state == self.OPEN
+                else None
+            )
+            return {
+                "state": state,
+                "recent_calls": len(self._calls),
+                "failure_rate": round(failure_rate, 3),
+                "slow_rate": round(slow_rate, 3),
+                "slow_call_seconds": self.slow_call_seconds,
+                "retry_in": round(retry_in, 1) if retry_in is not None else None,
+            }
+
+
+MODEL_PROVIDERS = ("gemini", "cohere", "mistral")
+
+BREAKERS = {
+    "gemini": CircuitBreaker("gemini", slow_call_seconds=20.0),
+    "cohere": CircuitBreaker("cohere", slow_call_seconds=20.0),
+    "mistral": CircuitBreaker("mistral", slow_call_seconds=20.0),
+    "tavily": CircuitBreaker("tavily", slow_call_seconds=5.0),
+    "news": CircuitBreaker("news", slow_call_seconds=5.0),
+    "weather": CircuitBreaker("weather", slow_call_seconds=5.0),
+}
+
+
+def all_providers_open():
+    return all(BREAKERS[name].state == CircuitBreaker.OPEN for name in MODEL_PROVIDERS)
+
+
+def breaker_states():
+    return {name: breaker.snapshot() for name, breaker in BREAKERS.items()}
+
+
 # =========================
 # Down Mode State
 # =========================
 IS_DOWN = False
 DOWN_REASON = None
 DOWN_TIMESTAMP = None
+DOWN_BY_BREAKERS = False  # lifted automatically once a provider recovers
 
 
 def set_down_mode(reason: str):
-    global IS_DOWN, DOWN_REASON, DOWN_TIMESTAMP
+    global IS_DOWN, DOWN_REASON, DOWN_TIMESTAMP, DOWN_BY_BREAKERS
+    # A single failing provider is handled by its breaker and the fallback
+    # chain — the whole service only goes down when every provider is out.
+    if not all_providers_open():
+        log_warn(f"⚠️ {reason} — not entering down mode, a provider is still up")
+        return
     IS_DOWN = True
+    DOWN_BY_BREAKERS = True
     DOWN_REASON = reason
     DOWN_TIMESTAMP = datetime.now().isoformat()
     log.error(f"🔥 DOWN MODE: {reason} at {DOWN_TIMESTAMP}")
@@ -280,7 +1219,13 @@ def set_down_mode(reason: str):
 # =========================
 @app.before_request
 def before_request_down_mode():
-    global IS_DOWN
+    global IS_DOWN, DOWN_REASON, DOWN_TIMESTAMP, DOWN_BY_BREAKERS
+    if IS_DOWN and DOWN_BY_BREAKERS and not all_providers_open():
+        IS_DOWN = False
+        DOWN_REASON = None
+        DOWN_TIMESTAMP = None
+        DOWN_BY_BREAKERS = False
+        log_ok("DOWN MODE DEACTIVATED (a provider circuit is probing again)")
     allowed_routes = [
         "mistai_status",
         "status",
@@ -323,7 +1268,7 @@ def before_request_down_mode():
 # Public API Routes
 # =========================
 @app.route("/api/chat", methods=["POST"])
-def api_chat():
+async def api_chat():
     try:
         data = request.get_json()
         if not data or "message" not in data:
@@ -366,14 +1311,41 @@ def api_chat():
         else:
             modified_message = user_message
 
+        hedge = data.get("hedge") if isinstance(data.get("hedge"), bool) else None
+
+        if wants_stream(data):
+            stream = FallbackStream(PROVIDERS[model], modified_message)
+            timer = request_timer()
+            model_started = time.monotonic()
+
+            def finalize_api(text):
+                timer.add("model", time.monotonic() - model_started)
+                if not text:
+                    return {"error": "Empty response from AI model", "is_down": IS_DOWN}
+                return {
+                    "response": text,
+                    "model": stream.model,
+                    "timestamp": datetime.now().isoformat(),
+                    "is_down": IS_DOWN,
+                }
+
+            def stream_error_api(e):
+                return {
+                    "error": "AI model failed to respond",
+                    "details": str(e),
+                    "is_down": IS_DOWN,
+                }
+
+            return sse_response(
+                stream_chat_events(stream, finalize_api, stream_error_api)
+            )
+
         ai_response = None
         try:
-            if model == "gemini":
-                ai_response = get_gemini_response(modified_message)
-            elif model == "cohere":
-                ai_response = get_cohere_response(modified_message)
-            elif model == "mistral":
-                ai_response = asyncio.run(get_mistral_response(modified_message))
+            with span("model"):
+                ai_response, served_model = await complete_with_policy(
+                    PROVIDERS[model], modified_message, hedge=hedge
+                )
         except Exception as e:
             log_err("Model execution failed")
             return (
@@ -397,7 +1369,7 @@ def api_chat():
             jsonify(
                 {
                     "response": ai_response,
-                    "model": model,
+                    "model": served_model,
                     "timestamp": datetime.now().isoformat(),
                     "is_down": IS_DOWN,
                 }
@@ -419,6 +1391,7 @@ def api_status():
             "down_reason": DOWN_REASON if IS_DOWN else None,
             "down_since": DOWN_TIMESTAMP if IS_DOWN else None,
             "available_models": ["gemini", "cohere", "mistral"],
+            "breakers": breaker_states(),
             "timestamp": datetime.now().isoformat(),
         }
     ), (200 if not IS_DOWN else 503)
@@ -429,6 +1402,9 @@ def api_status():
 # =========================
 @app.route("/status", methods=["GET"])
 def status():
+    # Readiness is informational — the status code still only follows down
+    # mode, so a flaky backend can't fail Fly's health check.
+    providers = model_registry.readiness()
     response = jsonify(
         {
             "online": not IS_DOWN,
@@ -438,6 +1414,10 @@ def status():
                 if not IS_DOWN
                 else "🔴 Mist.AI is currently unavailable"
             ),
+            "providers": providers,
+            "ready_providers": [
+                name for name, info in providers.items() if info["ready"]
+            ],
         }
     )
     response.headers["Cache-Control"] = "no-store"
@@ -530,8 +1510,9 @@ def root_files(filename):
 @app.route("/force-down-test")
 @dev_only
 def force_down_test():
-    global IS_DOWN, DOWN_REASON, DOWN_TIMESTAMP
+    global IS_DOWN, DOWN_REASON, DOWN_TIMESTAMP, DOWN_BY_BREAKERS
     IS_DOWN = True
+    DOWN_BY_BREAKERS = False
     DOWN_REASON = "Manual Test Mode"
     DOWN_TIMESTAMP = datetime.now().isoformat()
     log_warn(f"⚠️ DOWN MODE ACTIVATED (manual test) at {DOWN_TIMESTAMP}")
@@ -570,6 +1551,17 @@ def dev_status():
                 "is_down": IS_DOWN,
                 "down_reason": DOWN_REASON,
                 "down_timestamp": DOWN_TIMESTAMP,
+                "breakers": breaker_states(),
+                "context_sources": context_scheduler.snapshot(),
+                "caches": [
+                    tavily_router_cache.stats(),
+                    tavily_cache.stats(),
+                    grounding_store.stats(),
+                    response_cache.stats(),
+                    weather_geo_cache.stats(),
+                    weather_forecast_cache.stats(),
+                    weather_last_city.stats(),
+                ],
                 "available_test_routes": [
                     "/force-down-test",
                     "/reset-down-test",
@@ -588,9 +1580,18 @@ def dev_status():
 def download_logs():
     if not session.get("admin_logged_in"):
         return redirect(url_for("admin_login"))
-    log_dir = os.path.dirname(LOG_FILE)
-    log_name = os.path.basename(LOG_FILE)
-    return send_from_directory(log_dir or os.getcwd(), log_name, as_attachment=True)
+
+    # Same {"logs": [...]} document the old single-file log produced,
+    # streamed from the segments so it never sits in memory whole.
+    def generate():
+        yield '{"logs": ['
+        for i, entry in enumerate(chat_log_store.iter_entries()):
+            yield ("," if i else "") + "\n  " + json.dumps(entry, ensure_ascii=False)
+        yield "\n]}\n"
+
+    response = Response(generate(), mimetype="application/json")
+    response.headers["Content-Disposition"] = "attachment; filename=chat_logs.json"
+    return response
 
 
 # =========================
@@ -651,10 +1652,6 @@ def check_easter_eggs(user_message):
 # =========================
 # Clients & Config
 # =========================
-# weather_session only needs last_city; last_data was never used.
-weather_session = {"last_city": None}
-
-co = cohere.ClientV2(os.getenv("COHERE_API_KEY"))
 MISTRAL_API_KEY = os.getenv("MISTRAL_API_KEY")
 MISTRAL_ENDPOINT = "https://api.mistral.ai/v1/chat/completions"
 app.secret_key = os.getenv("FLASK_SECRET_KEY")
@@ -663,97 +1660,903 @@ API_KEY = os.getenv("OPENWEATHER_API_KEY")
 API_BASE_URL = "https://api.openweathermap.org/data/2.5"
 temperatureUnit = "imperial"
 
-TAVILY_CLIENT = TavilyClient(os.getenv("TAVILY_API_KEY"))
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-
 
 # =========================
-# Image Analysis
+# Lazy SDK Clients
 # =========================
-async def analyze_image_with_gemini(img_url_or_bytes):
-    if isinstance(img_url_or_bytes, str):
-        if img_url_or_bytes.startswith("http"):
-            image_bytes = requests.get(img_url_or_bytes).content
-        elif img_url_or_bytes.startswith("data:image/"):
-            header, b64data = img_url_or_bytes.split(",", 1)
-            image_bytes = base64.b64decode(b64data)
-        else:
-            with open(img_url_or_bytes, "rb") as f:
-                image_bytes = f.read()
-    else:
-        image_bytes = img_url_or_bytes
+# Fly stops idle machines, so cold starts hit real users.  The LLM/search
+# SDKs and sympy together take seconds to import; each is imported (and its
+# client built) on first use, or ahead of time by the prewarm thread.
+PREWARM_ENABLED = os.getenv("MISTAI_PREWARM", "true").lower() == "true"
 
-    from PIL import Image
+_lazy_objects = {}
+_lazy_lock = threading.Lock()
 
-    image = Image.open(io.BytesIO(image_bytes))
-    model = genai.GenerativeModel("gemini-2.5-flash")
-    response = model.generate_content(
-        ["Extract any text and describe the image in detail.", image]
-    )
-    return response.text.strip()
 
+def _lazy(name, build):
+    obj = _lazy_objects.get(name)
+    if obj is None:
+        with _lazy_lock:
+            obj = _lazy_objects.get(name)
+            if obj is None:
+                obj = _lazy_objects[name] = build()
+    return obj
 
-# =========================
-# GoFile Upload
-# =========================
-async def get_best_server():
-    response = requests.get("https://api.gofile.io/servers")
-    if response.status_code == 200:
-        return response.json()["data"]["servers"][0]["name"]
-    return None
 
+def get_genai():
+    def build():
+        import google.generativeai as genai
 
-async def upload_to_gofile(filename, file_content, mimetype):
-    server = await get_best_server()
-    if not server:
-        return {"error": "Failed to get server"}
-    files = {"file": (filename, io.BytesIO(file_content), mimetype)}
-    params = {"token": os.getenv("GOFLIE_API_KEY")}
-    upload_url = f"https://{server}.gofile.io/uploadFile"
-    response = requests.post(upload_url, files=files, data=params).json()
-    if response["status"] == "ok":
-        return {"link": response["data"]["downloadPage"]}
-    return {"error": "Upload failed"}
+        genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+        return genai
 
+    return _lazy("genai", build)
 
-# =========================
-# Math Parsing
-# =========================
-def parse_expression(text):
-    try:
-        return sympy.parse_expr(text)
-    except (SyntaxError, TypeError):
+
+def get_cohere_client():
+    def build():
+        import cohere
+
+        return cohere.ClientV2(os.getenv("COHERE_API_KEY"))
+
+    return _lazy("cohere", build)
+
+
+def get_tavily_client():
+    def build():
+        from tavily import TavilyClient
+
+        return TavilyClient(os.getenv("TAVILY_API_KEY"))
+
+    return _lazy("tavily", build)
+
+
+def get_sympy():
+    def build():
+        import sympy
+        import sympy.parsing.mathematica  # noqa: F401 — parse_expression fallback
+
+        return sympy
+
+    return _lazy("sympy", build)
+
+
+LAZY_ACCESSORS = (get_genai, get_cohere_client, get_tavily_client, get_sympy)
+
+
+def preload_sdk_modules():
+    """Import the SDK modules without building clients (safe before fork)."""
+    import google.generativeai  # noqa: F401
+    import cohere  # noqa: F401
+    import tavily  # noqa: F401
+    import sympy.parsing.mathematica  # noqa: F401
+
+
+def prewarm_clients():
+    """Import the SDKs and build their clients off the request path."""
+    started = time.monotonic()
+    for accessor in LAZY_ACCESSORS:
         try:
-            return parse_mathematica(text)
+            accessor()
         except Exception as e:
-            return f"⚠️ Parsing error: {str(e)}"
+            log_warn(f"⚠️ Prewarm of {accessor.__name__} failed: {e}")
+    log_ok(f"SDK clients prewarmed in {time.monotonic() - started:.2f}s")
 
 
 # =========================
-# Time / News Cache
+# HTTP Client Registry
 # =========================
-async def fetch_time_news_data() -> dict:
-    cache_key = "time_news"
-    cache_expiration = 600
-    now_ts = time.time()
+# One pooled client per upstream host so keep-alive connections (and their
+# TLS sessions) are reused across chat turns.  These are sync clients on
+# purpose: the SSE generators are sync and run on the server's threads, and
+# async code shares them through asyncio.to_thread, same as the Cohere/Tavily
+# SDKs.
+HTTP_CLIENT_PROFILES = {
+    "mistral": {
+        "http2": True,
+        "max_connections": 10,
+        "timeout": httpx.Timeout(60.0, connect=5.0),
+    },
+    "openweather": {
+        "http2": False,
+        "max_connections": 5,
+        "timeout": httpx.Timeout(10.0, connect=5.0),
+    },
+    "news": {
+        "http2": True,
+        "max_connections": 2,
+        "timeout": httpx.Timeout(10.0, connect=5.0),
+    },
+    "gofile": {
+        "http2": False,
+        "max_connections": 4,
+        "timeout": httpx.Timeout(120.0, connect=10.0),
+    },
+    # Arbitrary image URLs sent by users — unknown hosts, so stay on HTTP/1.1
+    "images": {
+        "http2": False,
+        "max_connections": 10,
+        "timeout": httpx.Timeout(15.0, connect=5.0),
+    },
+}
 
-    if cache_key in app.config:
-        cached = app.config[cache_key]
-        if (now_ts - cached["timestamp"]) < cache_expiration:
-            return cached["data"]
+_http_clients = {}
+_http_clients_lock = threading.Lock()
+
+
+def get_http_client(name):
+    """Return the shared pooled client for an upstream, creating it on first use."""
+    client = _http_clients.get(name)
+    if client is not None:
+        return client
+    with _http_clients_lock:
+        if name not in _http_clients:
+            profile = HTTP_CLIENT_PROFILES[name]
+            _http_clients[name] = httpx.Client(
+                http2=profile["http2"],
+                timeout=profile["timeout"],
+                limits=httpx.Limits(
+                    max_connections=profile["max_connections"],
+                    max_keepalive_connections=profile["max_connections"],
+                    keepalive_expiry=60.0,
+                ),
+                follow_redirects=True,
+            )
+        return _http_clients[name]
 
-    now = datetime.now(pytz.timezone("America/New_York"))
-    current_time = {
-        "date": now.strftime("%A, %B %d, %Y"),
+
+def get_checked(client, url, **kwargs):
+    """GET that raises on 5xx, so circuit breakers count server errors."""
+    response = client.get(url, **kwargs)
+    if response.status_code >= 500:
+        response.raise_for_status()
+    return response
+
+
+def close_http_clients():
+    with _http_clients_lock:
+        for name, client in list(_http_clients.items()):
+            try:
+                client.close()
+            except Exception as e:
+                log_warn(f"⚠️ Failed to close HTTP client {name}: {e}")
+        _http_clients.clear()
+
+
+atexit.register(close_http_clients)
+
+
+# =========================
+# TTL Cache
+# =========================
+class TTLCache:
+    """
+    Thread-safe LRU cache with a per-entry TTL and caps on entry count and
+    approximate size.  Sizes are estimated from the key and value (str/bytes
+    by length, anything else by sys.getsizeof) — good enough to bound memory.
+    """
+
+    def __init__(self, name, max_entries, max_bytes, default_ttl):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._data = OrderedDict()  # key -> (value, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _sizeof(key, value):
+        size = 0
+        for item in (key, value):
+            if isinstance(item, (str, bytes)):
+                size += len(item)
+            else:
+                size += sys.getsizeof(item)
+        return size
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires_at, size = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        size = self._sizeof(key, value)
+        if size > self.max_bytes:
+            return  # would evict everything else and then itself
+        expires_at = time.monotonic() + (ttl if ttl is not None else self.default_ttl)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = (value, expires_at, size)
+            self._bytes += size
+            while self._data and (
+                len(self._data) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "name": self.name,
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent async lookups: callers asking for a key that is
+    already being fetched await the same task instead of starting another.
+    Results are not kept — pair it with a cache.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    async def do(self, key, factory):
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self._tasks[key] = task
+
+            def forget(done):
+                if self._tasks.get(key) is done:
+                    del self._tasks[key]
+
+            task.add_done_callback(forget)
+        # one caller giving up must not cancel the fetch for the others
+        return await asyncio.shield(task)
+
+    def __len__(self):
+        return len(self._tasks)
+
+
+def normalized_key(text):
+    """Cache key for free text: case- and whitespace-insensitive, full length."""
+    normalized = " ".join(text.lower().split())
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()
+
+
+# Queries about things that change by the hour get a short TTL
+_NEWSY_HINTS = re.compile(
+    r"\b(current|currently|latest|today|tonight|now|recent|live|breaking|news|"
+    r"update|score|scores|standing|standings|price|prices|stock|stocks|weather|"
+    r"forecast|trending)\b",
+    re.IGNORECASE,
+)
+
+ROUTER_CACHE_TTL = 6 * 60 * 60
+GROUNDING_TTL_NEWS = 10 * 60
+GROUNDING_TTL_DEFAULT = 6 * 60 * 60
+
+tavily_router_cache = TTLCache(
+    "tavily_router",
+    max_entries=5000,
+    max_bytes=512 * 1024,
+    default_ttl=ROUTER_CACHE_TTL,
+)
+tavily_cache = TTLCache(
+    "tavily_grounding",
+    max_entries=500,
+    max_bytes=2 * 1024 * 1024,
+    default_ttl=GROUNDING_TTL_DEFAULT,
+)
+
+
+# TTL by query class; "miss" is a search that found nothing — worth retrying
+# soon, something may have been published since
+GROUNDING_TTLS = {
+    "news": GROUNDING_TTL_NEWS,
+    "default": GROUNDING_TTL_DEFAULT,
+    "miss": GROUNDING_TTL_NEWS,
+}
+
+
+def grounding_class(query):
+    return "news" if _NEWSY_HINTS.search(query) else "default"
+
+
+# =========================
+# Response Cache
+# =========================
+# Extension users send the same templated prompts over and over.  Answers
+# are cached per requested model and grounding request by normalized prompt
+# (case and whitespace), remembering which model actually answered.
+# Near-duplicate matching is opt-in (RESPONSE_CACHE_NEAR_MATCH): hashed
+# character-trigram vectors compared by cosine similarity with NumPy, but
+# only among cached prompts with the same content words, numbers and
+# operators in the same order — a different digit, weekday, negation, sign
+# or word order is a different prompt, however similar the text.
+RESPONSE_CACHE_TTL = 30 * 60
+RESPONSE_CACHE_TTL_GROUNDED = 5 * 60  # web answers go stale quickly
+RESPONSE_CACHE_MAX_ENTRIES = 1000
+RESPONSE_CACHE_MAX_BYTES = 8 * 1024 * 1024
+RESPONSE_CACHE_NEAR_MATCH = (
+    os.getenv("RESPONSE_CACHE_NEAR_MATCH", "false").lower() == "true"
+)
+RESPONSE_CACHE_SIMILARITY = float(os.getenv("RESPONSE_CACHE_SIMILARITY", "0.95"))
+RESPONSE_CACHE_NEAR_MIN_CHARS = 64  # short prompts only ever match exactly
+RESPONSE_CACHE_VECTOR_DIM = 512
+
+# The system prompt carries the clock and headlines, so answers to prompts
+# about either would be frozen for the cache TTL and served to everyone
+_TIME_HINTS = re.compile(
+    r"\b(time|date|day|days|today|tonight|tomorrow|yesterday|clock|hour|hours|"
+    r"week|weekend|month|year|ago|until|since|age|old|birthday|season)\b",
+    re.IGNORECASE,
+)
+
+
+def time_sensitive(prompt):
+    return bool(_NEWSY_HINTS.search(prompt) or _TIME_HINTS.search(prompt))
+
+
+# Templates whose argument is a question the user is asking; the others
+# carry a page or selection body, and almost every page says "today"
+_QUESTION_TEMPLATES = frozenset({"quiz", "fill_field"})
+
+
+def prompt_time_sensitive(prompt, template):
+    """time_sensitive() on the user's own words only, never a page body."""
+    template_id, argument = template
+    if template_id == "chat":
+        return time_sensitive(prompt)
+    if template_id in _QUESTION_TEMPLATES and argument:
+        return time_sensitive(argument)
+    return False
+
+
+_PROMPT_TOKENS = re.compile(r"\d+(?:[.,]\d+)*|[+\-*/=<>%^]|[^\W\d_]+")
+# Politeness filler only; negations and pronouns other than "you" count
+_FILLER_WORDS = frozenset(
+    "a an the please pls plz kindly can could would you just hey hi hello".split()
+)
+
+
+def content_signature(text):
+    """Tokens minus filler and punctuation; near matches must share it."""
+    return tuple(
+        t for t in _PROMPT_TOKENS.findall(text.lower()) if t not in _FILLER_WORDS
+    )
+
+
+def ngram_vector(text, dim=RESPONSE_CACHE_VECTOR_DIM):
+    """L2-normalized hashed character-trigram counts of the normalized text."""
+    data = np.frombuffer(" ".join(text.lower().split()).encode("utf-8"), np.uint8)
+    vector = np.zeros(dim, dtype=np.float32)
+    if len(data) < 3:
+        return vector
+    grams = (
+        (data[:-2].astype(np.uint32) << 16)
+        | (data[1:-1].astype(np.uint32) << 8)
+        | data[2:].astype(np.uint32)
+    )
+    buckets = (grams * np.uint32(2654435761)) % np.uint32(dim)  # Knuth hash
+    vector += np.bincount(buckets, minlength=dim).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class ResponseCacheEntry:
+    __slots__ = (
+        "model",
+        "response",
+        "grounded",
+        "expires_at",
+        "vector",
+        "bucket",
+        "size",
+    )
+
+    def __init__(self, model, response, grounded, expires_at, vector, bucket):
+        self.model = model
+        self.response = response
+        self.grounded = grounded
+        self.expires_at = expires_at
+        self.vector = vector
+        self.bucket = bucket  # (model, wants_grounding, content signature)
+        self.size = len(response) + (vector.nbytes if vector is not None else 0) + 160
+
+
+class ResponseCache:
+    def __init__(self, max_entries, max_bytes, near_match, similarity):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.near_match = near_match
+        self.similarity = similarity
+        # (model, wants_grounding, prompt key) -> entry, LRU first
+        self._entries = OrderedDict()
+        self._buckets = {}  # entry bucket -> [entry keys] sharing a signature
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _near_candidate(self, prompt):
+        return self.near_match and len(prompt) >= RESPONSE_CACHE_NEAR_MIN_CHARS
+
+    def lookup(self, model, prompt, wants_grounding=False):
+        """Return (response, grounded, served_model) or None."""
+        key = (model, bool(wants_grounding), normalized_key(prompt))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.response, entry.grounded, entry.model
+
+            if self._near_candidate(prompt):
+                bucket = (model, bool(wants_grounding), content_signature(prompt))
+                near = self._nearest(bucket, prompt, now)
+                if near is not None:
+                    self._entries.move_to_end(near)
+                    self.near_hits += 1
+                    entry = self._entries[near]
+                    return entry.response, entry.grounded, entry.model
+            self.misses += 1
+            return None
+
+    def _nearest(self, bucket, prompt, now):
+        keys = [
+            k
+            for k in self._buckets.get(bucket, ())
+            if self._entries[k].expires_at > now
+        ]
+        if not keys:
+            return None
+        matrix = np.stack([self._entries[k].vector for k in keys])
+        scores = matrix @ ngram_vector(prompt)
+        best = int(np.argmax(scores))
+        return keys[best] if scores[best] >= self.similarity else None
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        if entry.bucket is not None:
+            keys = self._buckets[entry.bucket]
+            keys.remove(key)
+            if not keys:
+                del self._buckets[entry.bucket]
+        return entry
+
+    def store(
+        self, model, prompt, response, grounded, wants_grounding=False, served_by=None
+    ):
+        """Cache under the requested `model`; `served_by` is who answered."""
+        ttl = RESPONSE_CACHE_TTL_GROUNDED if grounded else RESPONSE_CACHE_TTL
+        key = (model, bool(wants_grounding), normalized_key(prompt))
+        vector = bucket = None
+        if self._near_candidate(prompt):
+            vector = ngram_vector(prompt)
+            bucket = (model, bool(wants_grounding), content_signature(prompt))
+        entry = ResponseCacheEntry(
+            served_by or model,
+            response,
+            grounded,
+            time.monotonic() + ttl,
+            vector,
+            bucket,
+        )
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = entry
+            if bucket is not None:
+                self._buckets.setdefault(bucket, []).append(key)
+            self._bytes += entry.size
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.near_hits + self.misses
+        return {
+            "name": "responses",
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": (
+                round((self.hits + self.near_hits) / lookups, 3) if lookups else None
+            ),
+        }
+
+
+response_cache = ResponseCache(
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_MAX_BYTES,
+    RESPONSE_CACHE_NEAR_MATCH,
+    RESPONSE_CACHE_SIMILARITY,
+)
+
+
+# =========================
+# Image Analysis
+# =========================
+async def analyze_image_with_gemini(img_url_or_bytes):
+    if isinstance(img_url_or_bytes, str):
+        if img_url_or_bytes.startswith("http"):
+            response = await asyncio.to_thread(
+                get_http_client("images").get, img_url_or_bytes
+            )
+            image_bytes = response.content
+        elif img_url_or_bytes.startswith("data:image/"):
+            header, b64data = img_url_or_bytes.split(",", 1)
+            image_bytes = base64.b64decode(b64data)
+        else:
+            with open(img_url_or_bytes, "rb") as f:
+                image_bytes = f.read()
+    else:
+        image_bytes = img_url_or_bytes
+
+    return await asyncio.to_thread(describe_image, image_bytes)
+
+
+def describe_image(image_bytes):
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(image_bytes))
+    model, _ = model_registry.gemini()  # chat's config would cap the description
+    response = model.generate_content(
+        ["Extract any text and describe the image in detail.", image]
+    )
+    return response.text.strip()
+
+
+# =========================
+# GoFile Upload
+# =========================
+UPLOAD_QUEUE_SIZE = 16  # pending uploads; more than this are dropped
+UPLOAD_MAX_ATTEMPTS = 4
+UPLOAD_BACKOFF_BASE = 2.0  # seconds, doubled after every failed attempt
+UPLOAD_STATUS_KEEP = 100  # finished jobs remembered for the admin panel
+UPLOAD_SPOOL_DIR = os.path.join(tempfile.gettempdir(), "mistai-uploads")
+
+
+def get_best_server():
+    response = get_http_client("gofile").get("https://api.gofile.io/servers")
+    if response.status_code == 200:
+        return response.json()["data"]["servers"][0]["name"]
+    return None
+
+
+def upload_to_gofile(filename, file_path, mimetype):
+    server = get_best_server()
+    if not server:
+        return {"error": "Failed to get server"}
+    params = {"token": os.getenv("GOFLIE_API_KEY")}
+    upload_url = f"https://{server}.gofile.io/uploadFile"
+    with open(file_path, "rb") as f:
+        files = {"file": (filename, f, mimetype)}
+        response = (
+            get_http_client("gofile").post(upload_url, files=files, data=params).json()
+        )
+    if response["status"] == "ok":
+        return {"link": response["data"]["downloadPage"]}
+    return {"error": "Upload failed"}
+
+
+class UploadJob:
+    def __init__(self, filename, mimetype, path, size):
+        self.id = uuid.uuid4().hex[:12]
+        self.filename = filename
+        self.mimetype = mimetype
+        self.path = path
+        self.size = size
+        self.state = "queued"
+        self.attempts = 0
+        self.link = None
+        self.error = None
+        self.created = time.time()
+        self.updated = self.created
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "filename": self.filename,
+            "size": self.size,
+            "state": self.state,
+            "attempts": self.attempts,
+            "link": self.link,
+            "error": self.error,
+            "created": datetime.fromtimestamp(self.created).isoformat(),
+            "updated": datetime.fromtimestamp(self.updated).isoformat(),
+        }
+
+
+class UploadQueue:
+    """
+    Background GoFile uploads so /chat can return as soon as text is
+    extracted.  Files are spooled to disk, retried with exponential backoff,
+    and their status kept for the admin panel.
+    """
+
+    def __init__(self, maxsize, max_attempts, backoff_base, keep):
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.keep = keep
+        self._queue = queue_module.Queue(maxsize=maxsize)
+        self._jobs = OrderedDict()  # id -> UploadJob, oldest first
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+            self._thread = threading.Thread(target=self._worker, daemon=True)
+            self._thread.start()
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def submit(self, filename, content, mimetype):
+        """Spool the file and queue it. Never raises; returns the job."""
+        try:
+            with tempfile.NamedTemporaryFile(
+                dir=UPLOAD_SPOOL_DIR, prefix="upload-", delete=False
+            ) as f:
+                f.write(content)
+            job = UploadJob(filename, mimetype, f.name, len(content))
+        except Exception as e:
+            log_warn(f"⚠️ Could not spool upload {filename}: {e}")
+            return None
+
+        self._remember(job)
+        try:
+            self._queue.put_nowait(job)
+        except queue_module.Full:
+            self._finish(job, "dropped", error="Upload queue full")
+            log_warn(f"⚠️ Upload queue full → dropped {filename}")
+        return job
+
+    def _remember(self, job):
+        with self._lock:
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.keep:
+                oldest_id, oldest = next(iter(self._jobs.items()))
+                if oldest.state in ("queued", "uploading", "retrying"):
+                    break  # never forget in-flight jobs
+                del self._jobs[oldest_id]
+
+    def _finish(self, job, state, link=None, error=None):
+        job.state = state
+        job.link = link
+        job.error = error
+        job.updated = time.time()
+        try:
+            os.remove(job.path)
+        except OSError:
+            pass
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._process(job)
+            except Exception as e:
+                self._finish(job, "failed", error=str(e))
+                log_warn(f"⚠️ Upload worker error: {e}")
+
+    def _process(self, job):
+        for attempt in range(1, self.max_attempts + 1):
+            job.attempts = attempt
+            job.state = "uploading"
+            job.updated = time.time()
+            try:
+                result = upload_to_gofile(job.filename, job.path, job.mimetype)
+                if "link" in result:
+                    self._finish(job, "done", link=result["link"])
+                    log_ok(f"Uploaded {job.filename} to GoFile")
+                    return
+                job.error = result.get("error", "Upload failed")
+            except Exception as e:
+                job.error = f"{type(e).__name__}: {e}"
+            if attempt < self.max_attempts:
+                job.state = "retrying"
+                job.updated = time.time()
+                time.sleep(self.backoff_base * 2 ** (attempt - 1))
+        self._finish(job, "failed", error=job.error)
+        log_warn(f"⚠️ GoFile upload failed for {job.filename}: {job.error}")
+
+    def statuses(self):
+        """Known jobs, newest first."""
+        with self._lock:
+            return [job.to_dict() for job in reversed(self._jobs.values())]
+
+
+upload_queue = UploadQueue(
+    UPLOAD_QUEUE_SIZE, UPLOAD_MAX_ATTEMPTS, UPLOAD_BACKOFF_BASE, UPLOAD_STATUS_KEEP
+)
+
+
+# =========================
+# Math Parsing
+# =========================
+def parse_expression(text):
+    try:
+        return get_sympy().parse_expr(text)
+    except (SyntaxError, TypeError):
+        try:
+            return get_sympy().parsing.mathematica.parse_mathematica(text)
+        except Exception as e:
+            return f"⚠️ Parsing error: {str(e)}"
+
+
+# =========================
+# Context Refresher
+# =========================
+# Periodic context sources (headlines) are refreshed on the shared event
+# loop before they go stale, so requests only ever read the last good value.
+# A failing upstream is retried with exponential backoff; the old value keeps
+# being served until it is older than the source's max_stale.
+CONTEXT_TICK_SECONDS = 30  # longest the scheduler sleeps between checks
+CONTEXT_BACKOFF_BASE = 15
+CONTEXT_BACKOFF_MAX = 15 * 60
+
+
+class ContextSource:
+    def __init__(self, name, fetch, refresh_every, max_stale, default):
+        self.name = name
+        self.fetch = fetch  # async () -> value; raising counts as a failure
+        self.refresh_every = refresh_every
+        self.max_stale = max_stale
+        self.default = default
+        self.value = None
+        self.updated_at = None  # monotonic time of the last good fetch
+        self.next_refresh = 0.0
+        self.failures = 0
+        self.last_error = None
+        self._task = None
+
+    def age(self):
+        return time.monotonic() - self.updated_at if self.updated_at else None
+
+    def current(self):
+        """The last good value, or the default if none or too old. Never waits."""
+        age = self.age()
+        if age is None or age > self.max_stale:
+            return self.default
+        return self.value
+
+    def due(self):
+        return time.monotonic() >= self.next_refresh and not self.refreshing
+
+    @property
+    def refreshing(self):
+        return self._task is not None and not self._task.done()
+
+    async def refresh(self):
+        """Fetch now; concurrent callers share the refresh already running."""
+        if not self.refreshing:
+            self._task = asyncio.ensure_future(self._refresh())
+        return await asyncio.shield(self._task)
+
+    async def _refresh(self):
+        try:
+            value = await self.fetch()
+        except Exception as e:
+            self.failures += 1
+            self.last_error = f"{type(e).__name__}: {e}"
+            backoff = min(
+                CONTEXT_BACKOFF_BASE * 2 ** (self.failures - 1), CONTEXT_BACKOFF_MAX
+            )
+            self.next_refresh = time.monotonic() + backoff
+            log_warn(f"⚠️ {self.name} refresh failed, retry in {backoff}s: {e}")
+            return self.current()
+        self.value = value
+        self.updated_at = time.monotonic()
+        self.next_refresh = self.updated_at + self.refresh_every
+        self.failures = 0
+        self.last_error = None
+        return value
+
+    def snapshot(self):
+        age = self.age()
+        return {
+            "age_seconds": round(age, 1) if age is not None else None,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "refreshing": self.refreshing,
+            "next_refresh_in": round(max(self.next_refresh - time.monotonic(), 0), 1),
+        }
+
+
+class ContextScheduler:
+    def __init__(self):
+        self.sources = {}
+        self._started = False
+        self._lock = threading.Lock()
+
+    def add(self, source):
+        self.sources[source.name] = source
+        return source
+
+    async def _run(self):
+        while True:
+            for source in self.sources.values():
+                if source.due():
+                    asyncio.ensure_future(source.refresh())
+            now = time.monotonic()
+            wake = min(
+                [s.next_refresh for s in self.sources.values() if not s.refreshing],
+                default=now + CONTEXT_TICK_SECONDS,
+            )
+            await asyncio.sleep(min(max(wake - now, 1), CONTEXT_TICK_SECONDS))
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        loop = shared_loop.loop
+        loop.call_soon_threadsafe(lambda: loop.create_task(self._run()))
+
+    def snapshot(self):
+        return {name: source.snapshot() for name, source in self.sources.items()}
+
+
+context_scheduler = ContextScheduler()
+
+
+# =========================
+# Time / News Cache
+# =========================
+NEWS_REFRESH_SECONDS = 9 * 60  # refreshed before the old 10-minute expiry
+NEWS_MAX_STALE = 6 * 60 * 60  # older headlines are dropped, not shown
+
+
+def current_time_info() -> dict:
+    now = datetime.now(pytz.timezone("America/New_York"))
+    return {
+        "date": now.strftime("%A, %B %d, %Y"),
         "time": now.strftime("%I:%M %p %Z"),
     }
 
+
+async def fetch_headlines() -> list:
     news_api_key = os.getenv("THE_NEWS_API_KEY")
-    async with httpx.AsyncClient() as client:
-        response = await client.get(
+    response = await BREAKERS["news"].call(
+        asyncio.to_thread(
+            get_checked,
+            get_http_client("news"),
             "https://api.thenewsapi.com/v1/news/top",
             params={"api_token": news_api_key, "locale": "us", "limit": 3},
         )
+    )
     news_data = response.json()
 
     articles = []
@@ -770,10 +2573,33 @@ async def fetch_time_news_data() -> dict:
                     ),
                 }
             )
+    return articles
+
+
+news_source = context_scheduler.add(
+    ContextSource(
+        "news",
+        fetch_headlines,
+        refresh_every=NEWS_REFRESH_SECONDS,
+        max_stale=NEWS_MAX_STALE,
+        default=[],
+    )
+)
 
-    result = {"time": current_time, "news": articles}
-    app.config[cache_key] = {"data": result, "timestamp": now_ts}
-    return result
+
+def current_time_news() -> dict:
+    """Time plus the last refreshed headlines — what chat() uses. Never waits."""
+    return {"time": current_time_info(), "news": news_source.current()}
+
+
+async def fetch_time_news_data() -> dict:
+    # Before the first refresh lands, wait for it (shared with the scheduler);
+    # after a failure the backoff applies here too and the default is served
+    if news_source.updated_at is None and (
+        news_source.refreshing or news_source.due()
+    ):
+        await news_source.refresh()
+    return current_time_news()
 
 
 @app.route("/time-news", methods=["GET"])
@@ -787,44 +2613,84 @@ async def time_news():
 # =========================
 # File Processors
 # =========================
-def extract_text_from_pdf(file_stream):
-    try:
-        doc = fitz.open("pdf", file_stream.read())
-        text = "\n".join([page.get_text() for page in doc])
-        return text.strip() or "⚠️ No readable text found."
-    except Exception as e:
-        return f"⚠️ Error extracting text: {str(e)}"
+# Extraction runs in a small process pool so a 500-page PDF or a huge JSON
+# file can't pin the web worker's CPU.  Every job is capped by bytes, pages
+# and output characters, and killed if it runs past EXTRACT_TIMEOUT.  Jobs
+# wait for a free worker on the event loop, not in the pool's queue, so the
+# timeout only counts running time and a reset never cancels queued uploads.
+# The pool (and its forkserver) starts with the first upload, not at boot.
+EXTRACT_MAX_BYTES = 10 * 1024 * 1024
+EXTRACT_MAX_PAGES = 50
+EXTRACT_MAX_CHARS = 100_000
+EXTRACT_TIMEOUT = 20  # seconds
+EXTRACT_WORKERS = 1
+
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+_extract_slots = asyncio.Semaphore(EXTRACT_WORKERS)  # used on the shared loop
+
+
+def _extract_context():
+    # forkserver: workers fork from a small single-threaded server process
+    # that has only doc_extract imported, never from this multithreaded one,
+    # so replacing the pool after a timeout is safe mid-run.  Workers still
+    # re-run the main script as __mp_main__; wsgi.py, asgi.py and this file
+    # skip the app / startup() there.
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["doc_extract"])
+    return context
+
+
+def get_extract_pool():
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            _extract_pool = ProcessPoolExecutor(
+                max_workers=EXTRACT_WORKERS, mp_context=_extract_context()
+            )
+        return _extract_pool
 
 
-def process_txt(file_content):
-    return file_content.decode("utf-8", errors="ignore")
+def reset_extract_pool():
+    """Kill the pool (e.g. after a timeout); the next job starts a fresh one."""
+    global _extract_pool
+    with _extract_pool_lock:
+        pool, _extract_pool = _extract_pool, None
+    if pool is None:
+        return
+    # ProcessPoolExecutor can't cancel a running job, so terminate its workers
+    for process in list((pool._processes or {}).values()):
+        process.terminate()
+    pool.shutdown(wait=False, cancel_futures=True)
 
 
-def process_json(file_content):
-    try:
-        return json.dumps(json.loads(file_content.decode("utf-8")), indent=4)
-    except json.JSONDecodeError:
-        return "⚠️ Invalid JSON file."
+def shutdown_extract_pool():
+    with _extract_pool_lock:
+        if _extract_pool is not None:
+            _extract_pool.shutdown(wait=False, cancel_futures=True)
 
 
-def process_docx(file_content):
-    try:
-        doc = Document(io.BytesIO(file_content))
-        return (
-            "\n".join([p.text for p in doc.paragraphs]).strip()
-            or "⚠️ No readable text found."
-        )
-    except Exception as e:
-        return f"⚠️ Error reading .docx: {str(e)}"
+atexit.register(shutdown_extract_pool)
 
 
-file_processors = {
-    ".pdf": lambda c: extract_text_from_pdf(io.BytesIO(c)),
-    ".txt": process_txt,
-    ".json": process_json,
-    ".docx": process_docx,
-    ".doc": process_docx,
-}
+async def extract_document(filename, content):
+    ext = os.path.splitext(filename.lower())[1]
+    if ext not in doc_extract.PROCESSORS:
+        return "⚠️ Unsupported file type."
+    async with _extract_slots:
+        future = get_extract_pool().submit(
+            doc_extract.extract, ext, content, EXTRACT_MAX_PAGES, EXTRACT_MAX_CHARS
+        )
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), EXTRACT_TIMEOUT)
+        except asyncio.TimeoutError:
+            log_warn(f"⚠️ Extraction of {filename} timed out → resetting pool")
+            reset_extract_pool()
+            return "⚠️ This file took too long to read. Try a smaller file."
+        except BrokenProcessPool:
+            log_warn(f"⚠️ Extraction worker crashed on {filename} → resetting pool")
+            reset_extract_pool()
+            return "⚠️ Error extracting text: the file could not be processed."
 
 
 # =========================
@@ -832,82 +2698,230 @@ file_processors = {
 # =========================
 DB_FOLDER = "/app/data" if os.path.exists("/app/data") else "."
 DB_FILE = os.path.join(DB_FOLDER, "bans.db")
+BAN_SYNC_INTERVAL = 1.0  # seconds; how stale another worker's ban may be
+
 
+class BanIndex:
+    """
+    In-memory mirror of the bans table so ban checks are set lookups with
+    no disk I/O.  SQLite (WAL mode, one reused connection) is only written
+    when an admin bans/unbans or a banned token shows up from a new IP.
+    Bans other workers commit are picked up within `sync_interval` seconds.
+    """
+
+    def __init__(self, db_file, sync_interval):
+        self.db_file = db_file
+        self.sync_interval = sync_interval
+        self._next_sync = 0.0
+        self._conn = None
+        self._lock = threading.Lock()
+        self._ip_token = {}  # ip -> token (or None)
+        self._token_ip = {}  # token -> ip  (token is UNIQUE)
+        self._data_version = None
+
+    def open(self):
+        with self._lock:
+            if self._conn is not None:
+                return
+            conn = sqlite3.connect(self.db_file, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS bans (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    ip TEXT,
+                    token TEXT UNIQUE
+                )
+            """
+            )
+            # token already has the implicit index from its UNIQUE constraint
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_bans_ip ON bans(ip)")
+            conn.commit()
+            self._conn = conn
+            self._load()
+
+    def _load(self):
+        self._ip_token.clear()
+        self._token_ip.clear()
+        for ip, token in self._conn.execute("SELECT ip, token FROM bans"):
+            if ip:
+                self._ip_token[ip] = token
+            if token:
+                self._token_ip[token] = ip
+        self._data_version = self._data_version_now()
+
+    def _data_version_now(self):
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _sync(self):
+        # data_version moves when another connection (another gunicorn
+        # worker) commits; our own writes are already in the maps.
+        self._next_sync = time.monotonic() + self.sync_interval
+        if self._data_version_now() != self._data_version:
+            self._load()
+
+    @property
+    def opened(self):
+        return self._conn is not None
+
+    def is_banned(self, ip=None, token=None):
+        with self._lock:
+            # the hot path: at most one PRAGMA per sync_interval, else dicts only
+            if time.monotonic() >= self._next_sync:
+                self._sync()
+            return (ip is not None and ip in self._ip_token) or (
+                token is not None and token in self._token_ip
+            )
 
-def get_db_connection():
-    return sqlite3.connect(DB_FILE)
+    def add(self, ip, token=None):
+        with self._lock:
+            self._sync()
+            if ip in self._ip_token:
+                if self._ip_token[ip] or not token or token in self._token_ip:
+                    return  # nothing new to record
+                self._conn.execute("UPDATE bans SET token=? WHERE ip=?", (token, ip))
+                self._ip_token[ip] = token
+                self._token_ip[token] = ip
+            else:
+                # A token can only belong to one row; a known token seen from a
+                # new IP bans the IP on its own.
+                if token in self._token_ip:
+                    token = None
+                self._conn.execute(
+                    "INSERT INTO bans (ip, token) VALUES (?, ?)", (ip, token)
+                )
+                self._ip_token[ip] = token
+                if token:
+                    self._token_ip[token] = ip
+            self._conn.commit()
+
+    def remove(self, ip=None, token=None):
+        with self._lock:
+            if ip:
+                self._conn.execute("DELETE FROM bans WHERE ip=?", (ip,))
+                old_token = self._ip_token.pop(ip, None)
+                if old_token:
+                    self._token_ip.pop(old_token, None)
+            if token:
+                self._conn.execute("DELETE FROM bans WHERE token=?", (token,))
+                old_ip = self._token_ip.pop(token, None)
+                if old_ip:
+                    self._ip_token.pop(old_ip, None)
+            self._conn.commit()
+
+    def entries(self):
+        # from the table, not the maps: token-only rows have no IP key and
+        # an IP may hold several rows
+        with self._lock:
+            return self._conn.execute(
+                "SELECT ip, token FROM bans ORDER BY id"
+            ).fetchall()
+
+
+ban_index = BanIndex(DB_FILE, BAN_SYNC_INTERVAL)
 
 
 def init_db():
     os.makedirs(DB_FOLDER, exist_ok=True)
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute(
-        """
-        CREATE TABLE IF NOT EXISTS bans (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ip TEXT,
-            token TEXT UNIQUE
-        )
-    """
-    )
-    conn.commit()
-    conn.close()
+    ban_index.open()
     print(f"🗄️ Database initialized at {DB_FILE}")
 
 
+def get_ban_index():
+    """The ban index, opening the database on first use."""
+    if not ban_index.opened:
+        init_db()
+    return ban_index
+
+
 def add_ban(ip=None, token=None):
     if not ip:
         return
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT token FROM bans WHERE ip=?", (ip,))
-    row = c.fetchone()
-    if row:
-        if row[0]:
-            conn.close()
-            return
-        if token:
-            c.execute("UPDATE bans SET token=? WHERE ip=?", (token, ip))
-    else:
-        c.execute("INSERT INTO bans (ip, token) VALUES (?, ?)", (ip, token))
-    conn.commit()
-    conn.close()
+    get_ban_index().add(ip, token)
 
 
 def remove_ban(ip=None, token=None):
-    conn = get_db_connection()
-    c = conn.cursor()
-    if ip:
-        c.execute("DELETE FROM bans WHERE ip=?", (ip,))
-    if token:
-        c.execute("DELETE FROM bans WHERE token=?", (token,))
-    conn.commit()
-    conn.close()
+    get_ban_index().remove(ip, token)
 
 
 def get_bans():
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT ip, token FROM bans")
-    result = c.fetchall()
-    conn.close()
-    return result
+    return get_ban_index().entries()
 
 
 def is_banned(ip=None, token=None):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT 1 FROM bans WHERE ip=? OR token=?", (ip, token))
-    result = c.fetchone() is not None
-    conn.close()
-    return result
+    return get_ban_index().is_banned(ip, token)
 
 
 # =========================
 # In-Memory IP Log
 # =========================
-ip_log = {}
+IP_LOG_MAX_IPS = 1000  # least recently active IPs are evicted past this
+IP_LOG_PER_IP = 20  # most recent messages kept per IP
+IP_LOG_TOP_N = 50  # IPs shown on the admin page
+
+
+class IPLogEntry:
+    __slots__ = ("ts", "message")
+
+    def __init__(self, ts, message):
+        self.ts = ts
+        self.message = message
+
+    @property
+    def timestamp(self):
+        return datetime.fromtimestamp(self.ts).strftime("%Y-%m-%d %H:%M:%S")
+
+
+class IPActivity:
+    __slots__ = ("entries", "total", "last_seen")
+
+    def __init__(self, per_ip):
+        self.entries = deque(maxlen=per_ip)
+        self.total = 0
+        self.last_seen = 0.0
+
+
+class IPActivityLog:
+    """
+    Bounded per-IP activity: a ring buffer of recent messages per IP, a cap
+    on tracked IPs with LRU eviction of the idlest, and lifetime counters.
+    """
+
+    def __init__(self, max_ips, per_ip):
+        self.max_ips = max_ips
+        self.per_ip = per_ip
+        self._ips = OrderedDict()  # ip -> IPActivity, least recent first
+        self._lock = threading.Lock()
+
+    def record(self, ip, message):
+        now = time.time()
+        with self._lock:
+            activity = self._ips.get(ip)
+            if activity is None:
+                activity = self._ips[ip] = IPActivity(self.per_ip)
+                if len(self._ips) > self.max_ips:
+                    self._ips.popitem(last=False)
+            else:
+                self._ips.move_to_end(ip)
+            activity.entries.append(IPLogEntry(now, message))
+            activity.total += 1
+            activity.last_seen = now
+
+    def __len__(self):
+        return len(self._ips)
+
+    def total_messages(self):
+        with self._lock:
+            return sum(a.total for a in self._ips.values())
+
+    def top_active(self, n):
+        """The n IPs with the most messages, as (ip, activity) pairs."""
+        with self._lock:
+            return heapq.nlargest(n, self._ips.items(), key=lambda kv: kv[1].total)
+
+
+ip_log = IPActivityLog(IP_LOG_MAX_IPS, IP_LOG_PER_IP)
 
 
 # =========================
@@ -926,22 +2940,62 @@ def login_required(f):
 # =========================
 # Admin Routes
 # =========================
+ADMIN_LOG_PAGE_SIZE = 50
+ADMIN_LOG_PAGE_MAX = 200
+
+
 @app.route("/admin")
 @login_required
 def admin_panel():
     banned_entries = get_bans()
-    chat_logs = []
-    if os.path.exists(LOG_FILE):
-        try:
-            with open(LOG_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                chat_logs = data.get("logs", [])
-        except Exception:
-            chat_logs = []
     return render_template(
-        "admin/admin.html", ip_log=ip_log, banned_entries=banned_entries, chat_logs=chat_logs
+        "admin/admin.html",
+        ip_log=ip_log,
+        top_ips=ip_log.top_active(IP_LOG_TOP_N),
+        uploads=upload_queue.statuses(),
+        banned_entries=banned_entries,
+        logged_chats=len(chat_log_index),  # the log viewer updates it on load
+        log_page_size=ADMIN_LOG_PAGE_SIZE,
     )
 
+
+@app.route("/admin/logs")
+@login_required
+def admin_logs():
+    """Cursor-paged, filterable chat logs for the admin viewer (newest first)."""
+    args = request.args
+    try:
+        limit = min(int(args.get("limit", ADMIN_LOG_PAGE_SIZE)), ADMIN_LOG_PAGE_MAX)
+    except ValueError:
+        return jsonify({"error": "limit must be a number"}), 400
+    grounded = args.get("grounded")
+    try:
+        entries, next_cursor = chat_log_index.page(
+            cursor=args.get("cursor") or None,
+            limit=max(limit, 1),
+            ip=args.get("ip") or None,
+            model=args.get("model") or None,
+            grounded=None if grounded in (None, "") else grounded == "true",
+            since=args.get("since") or None,
+            until=args.get("until") or None,
+        )
+    except ValueError:
+        return jsonify({"error": "Invalid cursor"}), 400
+    return jsonify(
+        {
+            "logs": entries,
+            "next_cursor": next_cursor,
+            "total_indexed": len(chat_log_index),
+        }
+    )
+
+
+@app.route("/admin/uploads")
+@login_required
+def admin_uploads():
+    return jsonify({"uploads": upload_queue.statuses()})
+
+
 @app.route("/admin/ban", methods=["POST"])
 @login_required
 def admin_ban():
@@ -993,7 +3047,7 @@ def check_is_banned():
 
     banned = is_banned(ip, token)
     if banned:
-        add_ban(ip, token)
+        add_ban(ip, token)  # no-op unless this IP/token pair is new
 
     return jsonify({"banned": banned})
 
@@ -1026,17 +3080,40 @@ def admin_logout():
 # =========================
 # Startup
 # =========================
+def prewarm():
+    try:
+        get_ban_index()
+        get_grounding_store()
+    except Exception as e:
+        log_warn(f"⚠️ Prewarm of bans/grounding store failed: {e}")
+    prewarm_clients()
+    local_router.reload_if_changed()
+    model_registry.warm()
+
+
 def startup():
-    print("🚀 Starting up database...")
-    init_db()
+    # The ban database opens on first use (get_ban_index); SDK clients are
+    # built on first use or by the prewarm thread, the chat log index on the
+    # admin log viewer's first page, the extraction pool on the first upload.
+    print("🗂️ Preparing chat log segments...")
+    chat_log_store.import_legacy(LOG_FILE)
+    chat_log_store.close_stale_segments()
     print("✅ Starting up log writer thread...")
     log_writer = threading.Thread(target=_log_writer_thread, daemon=True)
     log_writer.start()
+    print("✅ Starting up upload worker...")
+    upload_queue.start()
+    print("📈 Starting up metrics server...")
+    start_metrics_server()
+    if PREWARM_ENABLED:
+        print("🔥 Prewarming in the background...")
+        threading.Thread(target=prewarm, daemon=True).start()
+    model_registry.start_probes()
+    print("📰 Starting up context refresher...")
+    context_scheduler.start()
     print("✅ Startup complete.")
 
 
-startup()
-
 ROUTER_MODEL = "command-r7b-12-2024"
 
 # Simple heuristics — covers 95% of "no search" cases without a list
@@ -1061,16 +3138,135 @@ def _quick_no(msg: str) -> bool:
     return False
 
 
+# =========================
+# Local Router
+# =========================
+# A hashed word-n-gram logistic model decides most routing calls on the CPU
+# in microseconds.  Only scores inside the uncertainty band go to the Cohere
+# router.  Weights are trained offline from the chat logs
+# (scripts/train_router.py) and loaded from ROUTER_MODEL_PATH; without a
+# model file every message goes to Cohere as before.
+ROUTER_MODEL_PATH = os.getenv(
+    "ROUTER_MODEL_PATH", os.path.join(LOG_DIR, "router_model.npz")
+)
+ROUTER_BAND_LOW = float(os.getenv("ROUTER_BAND_LOW", "0.2"))
+ROUTER_BAND_HIGH = float(os.getenv("ROUTER_BAND_HIGH", "0.8"))
+ROUTER_FEATURE_DIM = 1 << 16
+ROUTER_TEXT_CHARS = 120  # what chat logs keep of a message: train and serve alike
+ROUTER_RELOAD_CHECK = 60  # seconds between model file mtime checks
+
+_ROUTER_TOKEN = re.compile(r"[a-z0-9']+")
+
+
+def router_features(text, dim=ROUTER_FEATURE_DIM):
+    """
+    Sparse features for the local router: hashed word unigrams and bigrams,
+    L2-normalized counts.  Returns (indices, values) arrays.  crc32 keeps the
+    hashing identical across processes and between training and serving.
+    """
+    tokens = _ROUTER_TOKEN.findall(text[:ROUTER_TEXT_CHARS].lower())
+    grams = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    if not grams:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    hashed = np.fromiter(
+        (zlib.crc32(gram.encode("utf-8")) % dim for gram in grams),
+        dtype=np.int64,
+        count=len(grams),
+    )
+    indices, counts = np.unique(hashed, return_counts=True)
+    values = counts.astype(np.float32)
+    return indices, values / np.sqrt(np.dot(values, values))
+
+
+class LocalRouter:
+    """Logistic model over router_features, reloaded when the file changes."""
+
+    def __init__(self, path):
+        self.path = path
+        self.weights = None
+        self.bias = 0.0
+        self.info = {}
+        self._mtime = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def reload_if_changed(self):
+        now = time.monotonic()
+        if now - self._checked < ROUTER_RELOAD_CHECK and self._checked:
+            return
+        with self._lock:
+            self._checked = now
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                self.weights = None  # no model (or it was removed)
+                return
+            if mtime == self._mtime:
+                return
+            try:
+                with np.load(self.path) as model:
+                    weights = model["weights"].astype(np.float32)
+                    if weights.shape != (ROUTER_FEATURE_DIM,):
+                        raise ValueError(f"unexpected weights shape {weights.shape}")
+                    self.bias = float(model["bias"])
+                    self.info = json.loads(str(model["info"]))
+                self.weights = weights
+                self._mtime = mtime
+                log_ok(f"Local router loaded ({self.info.get('examples')} examples)")
+            except Exception as e:
+                self.weights = None
+                self._mtime = mtime  # don't retry a bad file until it changes
+                log_warn(f"⚠️ Local router model unusable: {e}")
+
+    def score(self, text):
+        """P(message needs a web search), or None when no model is loaded."""
+        self.reload_if_changed()
+        weights = self.weights
+        if weights is None:
+            return None
+        indices, values = router_features(text)
+        logit = self.bias + float(np.dot(weights[indices], values))
+        return float(1.0 / (1.0 + np.exp(-logit)))
+
+
+local_router = LocalRouter(ROUTER_MODEL_PATH)
+
+
+def note_router_decision(result, source, score=None):
+    """Log, count, and remember the routing decision for the chat log entry."""
+    decision = "YES" if result else "NO"
+    if source in ("local", "model"):
+        detail = f" (p={score:.2f})" if score is not None else ""
+        log_router(f"{decision} [{source}]{detail}")
+    ROUTER_DECISIONS.labels(decision, source).inc()
+    if has_request_context():
+        g.router = {
+            "decision": decision,
+            "source": source,
+            "score": round(score, 3) if score is not None else None,
+        }
+
+
 async def needs_tavily(user_message: str) -> bool:
     if _quick_no(user_message):
         log_router("NO")
+        note_router_decision(False, "heuristic")
         return False
 
     # Cache check
-    cache = app.config.setdefault("tavily_router_cache", {})
-    key = hashlib.sha1(user_message.strip().lower().encode()).hexdigest()
-    if key in cache:
-        return cache[key]
+    key = normalized_key(user_message)
+    cached = tavily_router_cache.get(key)
+    if cached is not None:
+        note_router_decision(cached, "cache")
+        return cached
+
+    # Local model — confident scores skip the Cohere round trip
+    score = local_router.score(user_message)
+    if score is not None and not ROUTER_BAND_LOW < score < ROUTER_BAND_HIGH:
+        result = score >= ROUTER_BAND_HIGH
+        tavily_router_cache.set(key, result)
+        note_router_decision(result, "local", score)
+        return result
 
     prompt = f"""
 You are a search routing classifier. Does this message require a live web search?
@@ -1100,7 +3296,7 @@ Message: \"\"\"{user_message}\"\"\"
 
     try:
         def sync_call():
-            response = co.chat(
+            response = get_cohere_client().chat(
                 model=ROUTER_MODEL,
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0,
@@ -1110,29 +3306,222 @@ Message: \"\"\"{user_message}\"\"\"
 
         decision = await asyncio.to_thread(sync_call)
         result = decision.startswith("YES")
-        cache[key] = result
-        log_router(decision)
+        tavily_router_cache.set(key, result)
+        note_router_decision(result, "model", score)
         return result
 
     except Exception as e:
         log_err(f"Router failed: {e}")
+        note_router_decision(False, "error", score)
         return False
 
 
+# =========================
+# Grounding Store
+# =========================
+# Tavily results persist in SQLite on the data volume, so a restarted (or
+# auto-started) machine and every gunicorn worker reuse searches already paid
+# for.  tavily_cache stays in front as the hot layer.  Rows expire by query
+# class; compaction drops expired rows and, past the size cap, the least
+# recently used ones.
+GROUNDING_DB_FILE = os.path.join(DB_FOLDER, "grounding.db")
+GROUNDING_STORE_MAX_BYTES = int(
+    os.getenv("GROUNDING_STORE_MAX_BYTES", str(32 * 1024 * 1024))
+)
+GROUNDING_COMPACT_EVERY = 200  # writes between compactions
+GROUNDING_COMPACT_TARGET = 0.8  # shrink to this fraction of the cap
+
+
+class GroundingStore:
+    def __init__(self, db_file, max_bytes):
+        self.db_file = db_file
+        self.max_bytes = max_bytes
+        self._conn = None
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.compactions = 0
+
+    def open(self):
+        with self._lock:
+            if self._conn is not None:
+                return
+            os.makedirs(os.path.dirname(self.db_file) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.db_file, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")  # only for new files
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS grounding (
+                    key TEXT PRIMARY KEY,
+                    query TEXT,
+                    result TEXT,
+                    query_class TEXT,
+                    created_at REAL,
+                    expires_at REAL,
+                    last_hit REAL,
+                    size INTEGER
+                )
+            """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_grounding_expires "
+                "ON grounding(expires_at)"
+            )
+            conn.commit()
+            self._conn = conn
+            self._compact()
+
+    @property
+    def opened(self):
+        return self._conn is not None
+
+    def get(self, key):
+        """(result, expires_at) for an unexpired row, else None."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result, expires_at FROM grounding "
+                "WHERE key=? AND expires_at > ?",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute(
+                "UPDATE grounding SET last_hit=? WHERE key=?", (now, key)
+            )
+            self._conn.commit()
+            self.hits += 1
+            return row
+
+    def put(self, key, query, result, query_class, ttl):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO grounding "
+                "(key, query, result, query_class, created_at, expires_at, "
+                "last_hit, size) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    query[:400],
+                    result,
+                    query_class,
+                    now,
+                    now + ttl,
+                    now,
+                    len(result) + len(query[:400]),
+                ),
+            )
+            self._conn.commit()
+            self._writes += 1
+            if self._writes % GROUNDING_COMPACT_EVERY == 0:
+                self._compact()
+
+    def _compact(self):
+        conn = self._conn
+        conn.execute("DELETE FROM grounding WHERE expires_at <= ?", (time.time(),))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM grounding").fetchone()
+        if total[0] > self.max_bytes:
+            # keep the most recently used rows that fit under the target
+            conn.execute(
+                """
+                DELETE FROM grounding WHERE key IN (
+                    SELECT key FROM (
+                        SELECT key, SUM(size) OVER (
+                            ORDER BY last_hit DESC, key
+                        ) AS kept
+                        FROM grounding
+                    ) WHERE kept > ?
+                )
+            """,
+                (int(self.max_bytes * GROUNDING_COMPACT_TARGET),),
+            )
+        conn.commit()
+        # execute() steps the pragma once, freeing a single page;
+        # executescript() runs it to completion
+        conn.executescript("PRAGMA incremental_vacuum;")
+        self.compactions += 1
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+    def stats(self):
+        entries = size = 0
+        if self._conn is not None:
+            with self._lock:
+                entries, size = self._conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM grounding"
+                ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "name": "grounding_store",
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "compactions": self.compactions,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+grounding_store = GroundingStore(GROUNDING_DB_FILE, GROUNDING_STORE_MAX_BYTES)
+
+
+def get_grounding_store():
+    """The grounding store, opening the database on first use."""
+    if not grounding_store.opened:
+        grounding_store.open()
+    return grounding_store
+
+
+async def lookup_grounding(key):
+    """Hot layer, then SQLite.  Store errors count as a miss."""
+    cached = tavily_cache.get(key)
+    if cached is not None:
+        return cached
+    try:
+        row = await asyncio.to_thread(lambda: get_grounding_store().get(key))
+    except Exception as e:
+        log_warn(f"⚠️ Grounding store read failed: {e}")
+        return None
+    if row is None:
+        return None
+    result, expires_at = row
+    tavily_cache.set(key, result, ttl=max(expires_at - time.time(), 1))
+    return result
+
+
+async def remember_grounding(key, query, result, query_class):
+    ttl = GROUNDING_TTLS[query_class]
+    tavily_cache.set(key, result, ttl=ttl)
+    try:
+        await asyncio.to_thread(
+            lambda: get_grounding_store().put(key, query, result, query_class, ttl)
+        )
+    except Exception as e:
+        log_warn(f"⚠️ Grounding store write failed: {e}")
+
+
 # =========================
 # Tavily Search
 # =========================
 async def tavily_search(query: str, max_results: int = 3) -> str:
+    """Best snippet for `query`; "" if Tavily found nothing, None if it failed."""
     query = query[:400]  # Tavily hard limit — never exceed 400 chars
     try:
 
         def sync_search():
             log_search(f"Tavily: {query[:80]}")
-            response = TAVILY_CLIENT.search(
+            response = get_tavily_client().search(
                 query=query, max_results=max_results, include_answer=True
             )
             if not response:
-                return None
+                return ""
             if "answer" in response and response["answer"]:
                 return response["answer"]
             if "results" in response and len(response["results"]) > 0:
@@ -1144,9 +3533,12 @@ async def tavily_search(query: str, max_results: int = 3) -> str:
                             return content
                 if "title" in first_result:
                     return f"{first_result.get('title', '')} - {first_result.get('url', '')}"
-            return None
+            return ""
 
-        return await asyncio.to_thread(sync_search)
+        return await BREAKERS["tavily"].call(asyncio.to_thread(sync_search))
+    except CircuitOpenError:
+        log_search("Tavily circuit open → skipping search")
+        return None
     except Exception as e:
         log_err(f"Tavily search failed: {e}")
         return None
@@ -1156,34 +3548,284 @@ async def get_grounding(user_message: str) -> str:
     if not user_message:
         return None
 
-    if "tavily_cache" not in app.config:
-        app.config["tavily_cache"] = {}
+    cache_key = normalized_key(user_message)
+    cached = await lookup_grounding(cache_key)
+    if cached is not None:
+        return cached
+
+    result = await tavily_search(user_message)
+    if result is None:
+        return "No relevant info found."  # an error or outage, not a miss — don't cache
+    if result:
+        await remember_grounding(
+            cache_key, user_message, result, grounding_class(user_message)
+        )
+        return result
+    await remember_grounding(cache_key, user_message, "No relevant info found.", "miss")
+    return "No relevant info found."
+
+
+@app.route("/tavily", methods=["POST"])
+async def tavily_route():
+    data = request.get_json(silent=True) or {}
+    query = str(data.get("query") or "").strip()
+    if not query:
+        return jsonify({"error": "Missing query"}), 400
+    try:
+        grounding = await get_grounding(query[:400])
+        return jsonify({"query": query, "grounding": grounding})
+    except Exception as e:
+        log_err(f"Tavily error: {e}")
+        return jsonify({"error": "Tavily search failed."}), 500
+
+
+# =========================
+# Pre-generation Pipeline
+# =========================
+# Everything chat() needs before the model call.  Image analysis is required;
+# routing → grounding is optional and has a deadline, so a slow Tavily call
+# drops its context instead of delaying the reply.  Headlines are not fetched
+# here at all — see Context Refresher.
+PREGEN_DEADLINE = 5.0  # seconds
+
+
+async def within_deadline(stage, coro, deadline, default):
+    """Await an optional stage; fall back to `default` on timeout or error."""
+    try:
+        return await asyncio.wait_for(coro, max(deadline - time.monotonic(), 0))
+    except asyncio.TimeoutError:
+        log_warn(f"⚠️ {stage} missed the {PREGEN_DEADLINE}s budget → skipping")
+    except Exception as e:
+        log_warn(f"⚠️ {stage} failed → skipping: {e}")
+    return default
+
+
+async def route_and_ground(user_message, tavily_query, user_wants_grounding):
+    use_tavily = user_wants_grounding or await timed(
+        "router", needs_tavily(user_message)
+    )
+    if not use_tavily:
+        return ""
+    grounding_text = await timed("grounding", get_grounding(tavily_query))
+    if grounding_text == "No relevant info found.":
+        return ""
+    return grounding_text
+
+
+async def _skipped(value):
+    return value
+
+
+async def run_pregeneration(img_url, user_message, tavily_query, user_wants_grounding):
+    """
+    Run the independent pre-generation stages concurrently.
+    Returns (image_analysis, grounding_text).
+    """
+    deadline = time.monotonic() + PREGEN_DEADLINE
+
+    image_stage = (
+        timed("image", analyze_image_with_gemini(img_url))
+        if img_url
+        else _skipped(None)
+    )
+    # Tavily routing — skip for image messages (query would be huge and useless)
+    grounding_stage = (
+        within_deadline(
+            "Tavily",
+            route_and_ground(user_message, tavily_query, user_wants_grounding),
+            deadline,
+            "",
+        )
+        if not img_url
+        else _skipped("")
+    )
+
+    return await asyncio.gather(image_stage, grounding_stage)
+
+
+# =========================
+# Prompt Templates
+# =========================
+# The browser extensions send fixed prompt templates (summarize a selection,
+# fill a form field, ...), sometimes with an entire web page attached.  The
+# classifier looks only at the head of the message: the first word picks the
+# candidates, a prefix check confirms one, and an anchored pattern pulls the
+# quoted argument — no pattern ever scans the page body.
+TEMPLATE_HEAD_CHARS = 600  # every template's argument starts before this
+
+# id -> (log label, lowercase prefix, argument pattern applied after prefix)
+PROMPT_TEMPLATES = {
+    "quiz": (
+        "Quiz",
+        "you are a knowledgeable assistant",
+        re.compile(r'.*?Question:\s*"([^"]*)', re.DOTALL),
+    ),
+    "fill_field": (
+        "Fill field",
+        "you are filling out a web form",
+        re.compile(r'.*?labeled:\s*"([^"]*)', re.DOTALL),
+    ),
+    "auto_fill": (
+        "Auto-fill",
+        "you are an ai form-filling assistant",
+        re.compile(r'\s*on "([^"]*)'),
+    ),
+    "improve": (
+        "Improve",
+        "improve the writing of this text",
+        re.compile(r'[^:\n]*:\s*"([^"]*)'),
+    ),
+    "rephrase": (
+        "Rephrase",
+        "rephrase this more clearly",
+        re.compile(r'[^:\n]*:\s*"([^"]*)'),
+    ),
+    # a quoted selection; falls through to page_summarize otherwise
+    "summarize": ("Summarize", "summarize this", re.compile(r'[^:\n]*:\s*"([^"]*)')),
+    "page_summarize": ("Page summarize", "summarize this web page", None),
+    "explain": (
+        "Explain",
+        "explain this in simple terms",
+        re.compile(r'[^:\n]*:\s*"([^"]*)'),
+    ),
+    "page_explain": ("Page explain", "explain what this web page", None),
+    "translate": (
+        "Translate",
+        "translate this to english",
+        re.compile(r'[^:\n]*:\s*"([^"]*)'),
+    ),
+}
+
+# first word -> candidate template ids, most specific first
+_TEMPLATES_BY_WORD = {}
+for _template_id, (_, _prefix, _) in PROMPT_TEMPLATES.items():
+    _TEMPLATES_BY_WORD.setdefault(_prefix.split()[0], []).append(_template_id)
+
+
+def classify_prompt(msg):
+    """
+    Return (template id, extracted argument) for an extension prompt, or
+    ("chat", None) for ordinary messages.  The argument is None for
+    templates without one and is cut to TEMPLATE_HEAD_CHARS at most.
+    """
+    head = msg[:TEMPLATE_HEAD_CHARS].lstrip()
+    first_word = head[:40].split(None, 1)[0].lower() if head else ""
+    for template_id in _TEMPLATES_BY_WORD.get(first_word, ()):
+        _, prefix, argument = PROMPT_TEMPLATES[template_id]
+        if not head[: len(prefix)].lower() == prefix:
+            continue
+        if argument is None:
+            return template_id, None
+        match = argument.match(head, len(prefix))
+        if match:
+            return template_id, match.group(1)
+    return "chat", None
+
+
+def clean_log_message(msg, classified=None):
+    """Short log/admin form of a message: "[Label] argument" for templates."""
+    template_id, argument = classified or classify_prompt(msg)
+    if template_id == "chat":
+        return msg[:120]
+    label = f"[{PROMPT_TEMPLATES[template_id][0]}]"
+    return (f"{label} {argument}" if argument is not None else label)[:120]
+
+
+# =========================
+# Context Packing
+# =========================
+# The client sends the whole conversation as `context` on every turn.  The
+# packer fits it into a per-model token budget: recent turns verbatim,
+# older ones shortened, the oldest dropped once the budget runs out.
+CONTEXT_TOKEN_BUDGETS = {
+    name: int(os.getenv(f"CONTEXT_BUDGET_{name.upper()}", default))
+    for name, default in (("gemini", 8000), ("cohere", 4000), ("mistral", 6000))
+}
+CONTEXT_KEEP_RECENT = 6  # newest turns kept verbatim whenever they fit
+CONTEXT_COMPRESSED_CHARS = 240  # older turns are cut to roughly this
+GROUNDING_RESERVE_TOKENS = 1000  # room kept for Tavily text + headlines
+_CODE_BLOCK = re.compile(r"```.*?```", re.DOTALL)
+
+
+def estimate_tokens(text):
+    """Rough local token count (~4 characters per token for English)."""
+    return (len(text) + 3) // 4
+
 
-    cache = app.config["tavily_cache"]
-    cache_key = f"tavily:{user_message.strip()[:50]}"
+def trim_to_tokens(text, max_tokens):
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    return text[: max_tokens * 4].rsplit(" ", 1)[0] + " …"
 
-    if cache_key in cache:
-        return cache[cache_key]
 
-    result = await tavily_search(user_message)
-    cache[cache_key] = result if result else "No relevant info found."
-    return cache[cache_key]
+def compress_turn(content):
+    """Shorten an old turn: code blocks elided, cut at a sentence boundary."""
+    text = " ".join(_CODE_BLOCK.sub("[code]", content).split())
+    if len(text) <= CONTEXT_COMPRESSED_CHARS:
+        return text
+    cut = text[:CONTEXT_COMPRESSED_CHARS]
+    sentence_end = max(cut.rfind(". "), cut.rfind("? "), cut.rfind("! "))
+    if sentence_end > CONTEXT_COMPRESSED_CHARS // 2:
+        return cut[: sentence_end + 1] + " …"
+    return cut.rsplit(" ", 1)[0] + " …"
 
 
-@app.route("/tavily", methods=["POST"])
-async def tavily_route():
-    data = await request.get_json()
-    query = data.get("query", "").strip()
-    if not query:
-        return jsonify({"error": "Missing query"}), 400
-    try:
-        grounding = await tavily_search(query)
-        return jsonify(
-            {"query": query, "grounding": grounding or "No relevant info found."}
-        )
-    except Exception as e:
-        log_err(f"Tavily error: {e}")
-        return jsonify({"error": "Tavily search failed."}), 500
+def pack_context(messages, budget):
+    """
+    Render `messages` ([{role, content}], oldest first) as "role: content"
+    lines within `budget` estimated tokens.  Back-to-back copies of a
+    message (client retries) collapse to one; a short reply repeated later
+    in the conversation ("yes", "thanks") is kept.  Returns (context_text,
+    stats).
+    """
+    turns = [
+        (m["role"], m["content"].strip())
+        for m in (messages if isinstance(messages, list) else [])
+        if isinstance(m, dict)
+        and isinstance(m.get("role"), str)
+        and isinstance(m.get("content"), str)
+        and m["content"].strip()
+    ]
+    stats = {"turns": len(turns), "deduped": 0, "compressed": 0, "dropped": 0}
+
+    previous = None
+    newest_first = []
+    for role, content in reversed(turns):
+        key = (role, normalized_key(content))
+        if key == previous:
+            stats["deduped"] += 1
+            continue
+        previous = key
+        newest_first.append((role, content))
+
+    lines, used = [], 0
+    for i, (role, content) in enumerate(newest_first):
+        line = f"{role}: {content}"
+        if i >= CONTEXT_KEEP_RECENT or used + estimate_tokens(line) > budget:
+            short = f"{role}: {compress_turn(content)}"
+            if short != line:
+                line = short
+                stats["compressed"] += 1
+        cost = estimate_tokens(line) + 1  # + newline
+        if used + cost > budget:
+            stats["dropped"] = len(newest_first) - i
+            break
+        lines.append(line)
+        used += cost
+
+    if stats["dropped"]:
+        lines.append(f"[{stats['dropped']} earlier messages omitted]")
+    stats["tokens"] = used
+    return "\n".join(reversed(lines)), stats
+
+
+def history_budget(model, *fixed_parts):
+    """Tokens left for history once the system prompt and `fixed_parts` fit."""
+    budget = CONTEXT_TOKEN_BUDGETS.get(model, CONTEXT_TOKEN_BUDGETS["mistral"])
+    fixed = estimate_tokens(SYSTEM_PROMPT_BASE) + sum(
+        estimate_tokens(part) for part in fixed_parts
+    )
+    return max(budget - fixed, 0)
 
 
 # =========================
@@ -1215,96 +3857,150 @@ async def chat():
             return jsonify({"error": "Message can't be empty."}), 400
 
         lower_msg = user_message.lower()
+        user_ip = (
+            data.get("ip")
+            or request.headers.get("X-Forwarded-For")
+            or request.remote_addr
+        )
+
+        with span("template"):
+            template = classify_prompt(user_message)
+        PROMPT_TEMPLATES_SEEN.labels(template[0]).inc()
+        log_message = clean_log_message(user_message, template)
+        streaming = wants_stream(data)
 
-        def clean_log_message(msg: str) -> str:
-            patterns = [
-                (r'You are a knowledgeable assistant.*?Question:\s*"(.+?)".*', r'[Quiz] \1'),
-                (r'You are filling out a web form.*?labeled:\s*"(.+?)".*', r'[Fill field] \1'),
-                (r'You are an AI form-filling assistant.*?on "(.+?)".*', r'[Auto-fill] \1'),
-                (r'Improve the writing of this text.*?:\s*"(.+?)".*', r'[Improve] \1'),
-                (r'Rephrase this more clearly.*?:\s*"(.+?)".*', r'[Rephrase] \1'),
-                (r'Summarize this.*?:\s*"(.+?)".*', r'[Summarize] \1'),
-                (r'Explain this in simple terms.*?:\s*"(.+?)".*', r'[Explain] \1'),
-                (r'Translate this to English.*?:\s*"(.+?)".*', r'[Translate] \1'),
-                (r'Summarize this web page.*', '[Page summarize]'),
-                (r'Explain what this web page.*', '[Page explain]'),
-            ]
-            for pattern, replacement in patterns:
-                cleaned = re.sub(pattern, replacement, msg, flags=re.DOTALL | re.IGNORECASE)
-                if cleaned != msg:
-                    return cleaned[:120]
-            return msg[:120]
-
-        log_message = clean_log_message(user_message)
+        def reply(payload):
+            if streaming:
+                return sse_response([sse_event(payload, event="done")])
+            return jsonify(payload)
 
         # Easter eggs / commands
         if response := check_easter_eggs(lower_msg):
-            return jsonify({"response": response})
+            return reply({"response": response})
 
         if lower_msg.startswith("/"):
-            return jsonify({"response": await handle_command(lower_msg)})
+            with span("command"):
+                return reply(
+                    {"response": await handle_command(lower_msg, client_id=user_ip)}
+                )
 
         if lower_msg == "random prompt":
-            return jsonify({"response": get_random_prompt()})
+            return reply({"response": get_random_prompt()})
 
         if lower_msg == "fun fact":
-            return jsonify({"response": get_random_fun_fact()})
+            return reply({"response": get_random_fun_fact()})
 
         # File uploads
         if "file" in request.files:
             file = request.files["file"]
             if not file.filename:
                 return jsonify({"error": "No file selected"}), 400
-            content = file.stream.read()
-            ext = os.path.splitext(file.filename.lower())[1]
-            extracted = file_processors.get(ext, lambda _: "⚠️ Unsupported file type.")(
-                content
-            )
-            await upload_to_gofile(file.filename, content, file.mimetype)
-            return jsonify(
+            content = file.stream.read(EXTRACT_MAX_BYTES + 1)
+            if len(content) > EXTRACT_MAX_BYTES:
+                return reply(
+                    {
+                        "response": f"⚠️ File is too large. The limit is "
+                        f"{EXTRACT_MAX_BYTES // (1024 * 1024)} MB."
+                    }
+                )
+            with span("extract"):
+                extracted = await extract_document(file.filename, content)
+            upload_queue.submit(file.filename, content, file.mimetype)
+            return reply(
                 {"response": extracted.strip() or "⚠️ No readable text found."}
             )
 
-        # Image handling
-        if img_url:
-            analysis = await analyze_image_with_gemini(img_url)
-            truncated = analysis[:80] + "..." if len(analysis) > 80 else analysis
-            user_message += f"\n\n[Image analysis: {analysis}]"
-            log_message += f"\n[Image: {truncated}]"
+        provider = get_provider(model_choice)
 
-        # Tavily routing — skip for image messages (query would be huge and useless)
-        grounding_text = ""
-        if not img_url:
-            try:
-                use_tavily = user_wants_grounding or await needs_tavily(user_message)
-                if use_tavily:
-                    # Use only the original user text as the query, capped at 400 chars
-                    tavily_query = (data.get("message") or "").strip()[:400]
-                    grounding_text = await get_grounding(tavily_query)
-                    if grounding_text == "No relevant info found.":
-                        grounding_text = ""
-            except Exception as e:
-                log_warn(f"⚠️ Tavily failed → skipping: {e}")
+        # Response cache — only stateless text prompts (no history, no image)
+        # whose answer doesn't depend on the clock or the news; clients opt
+        # out per request with "cache": false
+        cacheable = (
+            data.get("cache", True) is not False
+            and not chat_context
+            and not img_url
+            and not prompt_time_sensitive(user_message, template)
+        )
+        cache_prompt = user_message
+
+        def finish_chat(response_content, grounded, served_model):
+            # Safety fallback
+            response_content = apply_safety_fallback(response_content)
+
+            if cacheable and response_content != SAFETY_FALLBACK_MESSAGE:
+                # filed under the requested model, so a repeat finds it even
+                # when fallback or hedging had another provider answer
+                response_cache.store(
+                    provider.name,
+                    cache_prompt,
+                    response_content,
+                    grounded,
+                    wants_grounding=user_wants_grounding,
+                    served_by=served_model,
+                )
 
-        # Prompt assembly — always fetch fresh (uses internal 10-min cache)
-        context_text = "\n".join(f"{m['role']}: {m['content']}" for m in chat_context)
+            # IP logging
+            ip_log.record(user_ip, log_message)
 
-        tn = {"time": {}, "news": []}
-        for attempt in range(3):
-            try:
-                tn = await fetch_time_news_data()
-                break
-            except Exception as e:
-                log_warn(f"⚠️ time_news attempt {attempt + 1} failed: {e}")
+            log_chat(user_ip, served_model, log_message, response_content)
+            return response_content
+
+        if cacheable:
+            with span("cache"):
+                cached = response_cache.lookup(
+                    provider.name, cache_prompt, wants_grounding=user_wants_grounding
+                )
+            if cached is not None:
+                response_content, grounded, served_model = cached
+                ip_log.record(user_ip, log_message)
+                log_chat(user_ip, served_model, log_message, response_content)
+                safe_log_chat(
+                    user_ip,
+                    served_model,
+                    log_message,
+                    response_content,
+                    grounded,
+                    timings=request_timer().as_dict(),
+                    template=template[0],
+                )
+                return reply(
+                    {
+                        "response": response_content,
+                        "model": served_model,
+                        "cached": True,
+                    }
+                )
+
+        # Image analysis, Tavily routing/grounding and headlines run concurrently
+        analysis, grounding_text = await run_pregeneration(
+            img_url,
+            user_message,
+            # Use only the original user text as the query, capped at 400 chars
+            (data.get("message") or "").strip()[:400],
+            user_wants_grounding,
+        )
+        router = g.get("router")  # set by needs_tavily, if it ran
+
+        if analysis:
+            truncated = analysis[:80] + "..." if len(analysis) > 80 else analysis
+            user_message += f"\n\n[Image analysis: {analysis}]"
+            log_message += f"\n[Image: {truncated}]"
 
-        current_date = tn.get("time", {}).get("date", "Unknown Date")
-        current_time_str = tn.get("time", {}).get("time", "Unknown Time")
+        # Prompt assembly — headlines come from the background refresher
+        tn = current_time_news()
+        current_date = tn["time"]["date"]
+        current_time_str = tn["time"]["time"]
         headlines = "; ".join(
             [a["title"] for a in tn.get("news", []) if a.get("title")]
         )
         time_news_ctx = f"Today is {current_date}, current time is {current_time_str}."
         if headlines:
             time_news_ctx += f"\nRecent headlines: {headlines}"
+        if grounding_text:
+            grounding_text = trim_to_tokens(
+                grounding_text,
+                GROUNDING_RESERVE_TOKENS - estimate_tokens(time_news_ctx),
+            )
 
         system_context = (
             "\n".join(
@@ -1323,6 +4019,14 @@ async def chat():
             or "No external context available."
         )
 
+        with span("context"):
+            context_text, packing = pack_context(
+                chat_context,
+                history_budget(provider.name, system_context, user_message),
+            )
+        if packing["dropped"] or packing["compressed"]:
+            log.info(f"🧳 Context packed for {provider.name}: {packing}")
+
         full_prompt = (
             f"System: [{system_context}]\n"
             f"{context_text}\n"
@@ -1330,35 +4034,52 @@ async def chat():
             f"Mist.AI:"
         )
 
-        # Model response
-        if model_choice == "gemini":
-            response_content = get_gemini_response(full_prompt)
-        elif model_choice == "cohere":
-            response_content = get_cohere_response(full_prompt)
-        else:
-            response_content = await get_mistral_response(full_prompt)
+        if streaming:
+            stream = FallbackStream(provider, full_prompt)
+            timer = request_timer()
+            model_started = time.monotonic()
+
+            def finalize_chat(text):
+                timer.add("model", time.monotonic() - model_started)
+                response_content = finish_chat(text, bool(grounding_text), stream.model)
+                safe_log_chat(
+                    user_ip,
+                    stream.model,
+                    log_message,
+                    response_content,
+                    bool(grounding_text),
+                    timings=timer.as_dict(),
+                    template=template[0],
+                    router=router,
+                )
+                return {"response": response_content, "model": stream.model}
 
-        # Safety fallback
-        if any(
-            x in response_content.lower() for x in ["i don't know", "not sure", "sorry"]
-        ):
-            response_content = "🤖 Try rephrasing — I didn't quite get that."
+            def stream_error_chat(e):
+                set_down_mode(type(e).__name__)
+                return {
+                    "error": str(e),
+                    "is_down": IS_DOWN,
+                    "reason": DOWN_REASON,
+                    "timestamp": DOWN_TIMESTAMP,
+                }
 
-        # IP logging
-        user_ip = (
-            data.get("ip")
-            or request.headers.get("X-Forwarded-For")
-            or request.remote_addr
-        )
+            return sse_response(
+                stream_chat_events(stream, finalize_chat, stream_error_chat)
+            )
 
-        ip_log.setdefault(user_ip, []).append(
-            {
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "message": log_message,
-            }
-        )
+        # Model response
+        with span("model"):
+            response_content, served_model = await complete_with_policy(
+                provider,
+                full_prompt,
+                hedge=(
+                    data.get("hedge") if isinstance(data.get("hedge"), bool) else None
+                ),
+            )
 
-        log_chat(user_ip, model_choice, log_message, response_content)
+        response_content = finish_chat(
+            response_content, bool(grounding_text), served_model
+        )
 
         # Log to disk AFTER the response is delivered to the client.
         # The 30-second flush delay in _log_writer_thread ensures the file
@@ -1367,14 +4088,17 @@ async def chat():
         def log_after_response(response):  # noqa: F841
             safe_log_chat(
                 user_ip,
-                model_choice,
+                served_model,
                 log_message,
                 response_content,
                 bool(grounding_text),
+                timings=request_timer().as_dict(),
+                template=template[0],
+                router=router,
             )
             return response
 
-        return jsonify({"response": response_content})
+        return jsonify({"response": response_content, "model": served_model})
 
     except Exception as e:
         log_err(f"Chat route error: {type(e).__name__}: {e}")
@@ -1383,7 +4107,7 @@ async def chat():
             jsonify(
                 {
                     "error": str(e),
-                    "is_down": True,
+                    "is_down": IS_DOWN,
                     "reason": DOWN_REASON,
                     "timestamp": DOWN_TIMESTAMP,
                 }
@@ -1395,7 +4119,8 @@ async def chat():
 # =========================
 # Command Handler
 # =========================
-async def handle_command(command):
+async def handle_command(command, client_id=None):
+    """Run a slash command.  client_id keys per-client state (last /weather city)."""
     command = command.strip().lower()
 
     if command == "/":
@@ -1468,14 +4193,17 @@ async def handle_command(command):
         riddle = random.choice(riddles)
         return f"🤔 {riddle[0]}<br><br><span class='hidden-answer' onclick='this.classList.add(\"revealed\")'>Answer: {riddle[1]}</span>"
 
-    global weather_session
     if command.startswith("/weather"):
         parts = command.split(" ", 1)
-        city = parts[1].strip() if len(parts) > 1 else weather_session.get("last_city")
+        city = parts[1].strip() if len(parts) > 1 else None
+        if not city and client_id:
+            city = weather_last_city.get(client_id)
         if not city:
             return "❌ Please provide a city name. Example: `/weather New York`"
-        weather_session["last_city"] = city
-        weather_data = await get_weather_data(city)
+        if client_id:
+            weather_last_city.set(client_id, city)
+        with span("weather"):
+            weather_data = await get_weather_data(city)
         if "error" in weather_data:
             return f"❌ Error: {weather_data['error']}"
         if "hourly" in weather_data:
@@ -1557,40 +4285,148 @@ TEMPERATURE = 0.3
 MAX_TOKENS = 1024
 
 
-def get_gemini_response(prompt):
-    system_prompt = build_system_prompt(
-        "Mist.AI Nova", "Hey, I'm Mist.AI Nova! How can I help? ✨"
-    )
+# =========================
+# Provider Registry
+# =========================
+# Personas' system prompts, SDK model objects and request templates are
+# built once and shared by every request (SDK/HTTP clients are thread-safe).
+# The registry also probes each backend — on prewarm, then every
+# PROVIDER_PROBE_INTERVAL — so /status shows which ones are reachable.
+GEMINI_MODEL = "gemini-2.5-flash"
+COHERE_MODEL = "command-r7b-12-2024"
+MISTRAL_MODEL = "mistral-small-latest"
+PROVIDER_PROBE_INTERVAL = 5 * 60  # seconds
+PROVIDER_PROBE_TIMEOUT = 10  # seconds
+
+PERSONAS = {
+    "gemini": ("Mist.AI Nova", "Hey, I'm Mist.AI Nova! How can I help? ✨"),
+    "cohere": ("Mist.AI Sage", "Hey, I'm Mist.AI Sage! How can I help? ✨"),
+    "mistral": ("Mist.AI Flux", "Hey, I'm Mist.AI Flux! How can I help? ✨"),
+}
+
 
-    full_prompt = f"{system_prompt}\n{prompt}"
+class ProviderRegistry:
+    def __init__(self):
+        self.system_prompts = {
+            name: build_system_prompt(*persona) for name, persona in PERSONAS.items()
+        }
+        self.mistral_headers = {
+            "Authorization": f"Bearer {MISTRAL_API_KEY}",
+            "Content-Type": "application/json",
+        }
+        self._gemini = None  # (GenerativeModel, GenerationConfig)
+        self._lock = threading.Lock()
+        self._probes = {}  # name -> last probe result
+        self._probe_thread = None
+
+    def gemini(self):
+        """Shared (model, generation_config) for Gemini."""
+        if self._gemini is None:
+            with self._lock:
+                if self._gemini is None:
+                    genai = get_genai()
+                    self._gemini = (
+                        genai.GenerativeModel(GEMINI_MODEL),
+                        genai.types.GenerationConfig(
+                            temperature=TEMPERATURE,
+                            max_output_tokens=MAX_TOKENS,
+                        ),
+                    )
+        return self._gemini
 
-    model = genai.GenerativeModel("gemini-2.5-flash")
-    chat_session = model.start_chat()
+    def messages(self, name, prompt):
+        """System + user chat messages for Cohere/Mistral."""
+        return [
+            {"role": "system", "content": self.system_prompts[name]},
+            {"role": "user", "content": prompt},
+        ]
 
-    response = chat_session.send_message(
-        full_prompt,
-        generation_config=genai.types.GenerationConfig(
-            temperature=TEMPERATURE,
-            max_output_tokens=MAX_TOKENS,
-        ),
-    )
+    def _probe_gemini(self):
+        get_genai().get_model(
+            f"models/{GEMINI_MODEL}",
+            # no retry: the SDK default retries a dead network for minutes
+            request_options={"timeout": PROVIDER_PROBE_TIMEOUT, "retry": None},
+        )
 
-    return response.text.strip()
+    def _probe_cohere(self):
+        get_cohere_client().models.list(
+            page_size=1,
+            request_options={"timeout_in_seconds": PROVIDER_PROBE_TIMEOUT},
+        )
 
+    def _probe_mistral(self):
+        # Also leaves a warm keep-alive connection in the pooled client
+        get_http_client("mistral").get(
+            "https://api.mistral.ai/v1/models",
+            headers=self.mistral_headers,
+            timeout=PROVIDER_PROBE_TIMEOUT,
+        ).raise_for_status()
 
-def get_cohere_response(prompt: str):
-    system_prompt = build_system_prompt(
-        "Mist.AI Sage", "Hey, I'm Mist.AI Sage! How can I help? ✨"
-    )
+    def probe(self, name):
+        started = time.monotonic()
+        try:
+            getattr(self, f"_probe_{name}")()
+            result = {"ok": True, "error": None}
+        except Exception as e:
+            result = {"ok": False, "error": f"{type(e).__name__}: {e}"[:200]}
+            log_warn(f"⚠️ {name} readiness probe failed: {result['error']}")
+        result["latency_ms"] = round((time.monotonic() - started) * 1000, 1)
+        result["checked_at"] = datetime.now().isoformat()
+        self._probes[name] = result
+        return result
 
-    messages = [
-        {"role": "system", "content": system_prompt},
-        {"role": "user", "content": prompt},
-    ]
+    def probe_all(self):
+        for name in PERSONAS:
+            self.probe(name)
 
-    resp = co.chat(
-        model="command-r7b-12-2024",
-        messages=messages,
+    def warm(self):
+        """Build the shared objects and probe every backend."""
+        try:
+            self.gemini()
+        except Exception as e:
+            log_warn(f"⚠️ Gemini model setup failed: {e}")
+        self.probe_all()
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(PROVIDER_PROBE_INTERVAL)
+            self.probe_all()
+
+    def start_probes(self):
+        if self._probe_thread is None:
+            self._probe_thread = threading.Thread(target=self._probe_loop, daemon=True)
+            self._probe_thread.start()
+
+    def readiness(self):
+        """Per-provider readiness: last probe, and an open breaker means not ready."""
+        report = {}
+        for name in PERSONAS:
+            probe = self._probes.get(name)
+            breaker = BREAKERS[name].state
+            if breaker == CircuitBreaker.OPEN:
+                ready = False
+            else:
+                ready = probe["ok"] if probe else None  # None: not probed yet
+            report[name] = {"ready": ready, "breaker": breaker, "probe": probe}
+        return report
+
+
+model_registry = ProviderRegistry()
+
+
+def get_gemini_response(prompt):
+    model, config = model_registry.gemini()
+    full_prompt = f"{model_registry.system_prompts['gemini']}\n{prompt}"
+
+    response = model.generate_content(full_prompt, generation_config=config)
+
+    return response.text.strip()
+
+
+def get_cohere_response(prompt: str):
+    resp = get_cohere_client().chat(
+        model=COHERE_MODEL,
+        messages=model_registry.messages("cohere", prompt),
         temperature=TEMPERATURE,
         max_tokens=MAX_TOKENS,
     )
@@ -1599,78 +4435,515 @@ def get_cohere_response(prompt: str):
 
 
 async def get_mistral_response(prompt):
-    system_prompt = build_system_prompt(
-        "Mist.AI Flux", "Hey, I'm Mist.AI Flux! How can I help? ✨"
+    payload = {
+        "model": MISTRAL_MODEL,
+        "messages": model_registry.messages("mistral", prompt),
+        "temperature": TEMPERATURE,
+        "max_tokens": MAX_TOKENS,
+    }
+
+    response = await asyncio.to_thread(
+        get_http_client("mistral").post,
+        MISTRAL_ENDPOINT,
+        headers=model_registry.mistral_headers,
+        json=payload,
     )
+    response.raise_for_status()
+    data = response.json()
+
+    return data["choices"][0]["message"]["content"].strip()
+
+
+# =========================
+# Streaming (Server-Sent Events)
+# =========================
+SAFETY_FALLBACK_TRIGGERS = ["i don't know", "not sure", "sorry"]
+SAFETY_FALLBACK_MESSAGE = "🤖 Try rephrasing — I didn't quite get that."
+
+
+def apply_safety_fallback(response_content):
+    if any(x in response_content.lower() for x in SAFETY_FALLBACK_TRIGGERS):
+        return SAFETY_FALLBACK_MESSAGE
+    return response_content
+
+
+def wants_stream(data):
+    """A client opts into streaming with "stream": true or an SSE Accept header."""
+    if data.get("stream") is True:
+        return True
+    return "text/event-stream" in request.headers.get("Accept", "")
 
-    headers = {
-        "Authorization": f"Bearer {MISTRAL_API_KEY}",
-        "Content-Type": "application/json",
-    }
+
+def sse_event(payload, event=None):
+    message = f"data: {json.dumps(payload)}\n\n"
+    if event:
+        message = f"event: {event}\n{message}"
+    return message
+
+
+def sse_response(events):
+    # No stream_with_context: async views run in a copied contextvars context,
+    # so the request can't be re-pushed around the body.  Generators capture
+    # what they need from the request before returning.
+    response = Response(events, mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # keep proxies from buffering
+    return response
+
+
+def stream_chat_events(chunks, finalize, on_error):
+    """
+    Relay provider chunks as `data: {"token": ...}` events, then a single
+    `event: done` carrying finalize(full_text) — the same payload the JSON
+    route returns.  The done event is authoritative: the safety fallback may
+    replace the text the tokens spelled out.  A provider failure mid-stream
+    ends with `event: error` carrying on_error(exc).
+    """
+    parts = []
+    try:
+        for chunk in chunks:
+            parts.append(chunk)
+            yield sse_event({"token": chunk})
+    except Exception as e:
+        log_err(f"Stream error: {type(e).__name__}: {e}")
+        yield sse_event(on_error(e), event="error")
+        return
+    yield sse_event(finalize("".join(parts).strip()), event="done")
+
+
+def stream_gemini_response(prompt):
+    model, config = model_registry.gemini()
+    full_prompt = f"{model_registry.system_prompts['gemini']}\n{prompt}"
+
+    response = model.generate_content(
+        full_prompt, generation_config=config, stream=True
+    )
+
+    for chunk in response:
+        try:
+            text = chunk.text
+        except ValueError:
+            continue  # chunk without text parts (e.g. the final finish_reason chunk)
+        if text:
+            yield text
+
+
+def stream_cohere_response(prompt: str):
+    for event in get_cohere_client().chat_stream(
+        model=COHERE_MODEL,
+        messages=model_registry.messages("cohere", prompt),
+        temperature=TEMPERATURE,
+        max_tokens=MAX_TOKENS,
+    ):
+        if event.type == "content-delta":
+            text = event.delta.message.content.text
+            if text:
+                yield text
+
+
+def stream_mistral_response(prompt):
+    headers = {**model_registry.mistral_headers, "Accept": "text/event-stream"}
 
     payload = {
-        "model": "mistral-small-latest",
-        "messages": [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt},
-        ],
+        "model": MISTRAL_MODEL,
+        "messages": model_registry.messages("mistral", prompt),
         "temperature": TEMPERATURE,
         "max_tokens": MAX_TOKENS,
+        "stream": True,
     }
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(MISTRAL_ENDPOINT, headers=headers, json=payload)
+    with get_http_client("mistral").stream(
+        "POST", MISTRAL_ENDPOINT, headers=headers, json=payload
+    ) as response:
         response.raise_for_status()
-        data = response.json()
+        for line in response.iter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:"):].strip()
+            if data == "[DONE]":
+                break
+            delta = json.loads(data)["choices"][0].get("delta", {})
+            if delta.get("content"):
+                yield delta["content"]
+
+
+# =========================
+# Provider Adapters
+# =========================
+class ProviderAdapter(ABC):
+    """
+    Uniform interface over the chat model backends.  complete() is always
+    safe to await from a view: blocking SDK calls are pushed to a worker
+    thread so the event loop never stalls on an LLM round trip.  stream()
+    returns a sync iterator of text chunks for Flask's streaming responses.
+    """
+
+    name = None
 
-        return data["choices"][0]["message"]["content"].strip()
+    @abstractmethod
+    async def complete(self, prompt):
+        """The full reply text."""
+
+    @abstractmethod
+    def stream(self, prompt):
+        """A sync iterator of reply text chunks."""
+
+
+class GeminiAdapter(ProviderAdapter):
+    name = "gemini"
+
+    async def complete(self, prompt):
+        return await asyncio.to_thread(get_gemini_response, prompt)
+
+    def stream(self, prompt):
+        return stream_gemini_response(prompt)
+
+
+class CohereAdapter(ProviderAdapter):
+    name = "cohere"
+
+    async def complete(self, prompt):
+        return await asyncio.to_thread(get_cohere_response, prompt)
+
+    def stream(self, prompt):
+        return stream_cohere_response(prompt)
+
+
+class MistralAdapter(ProviderAdapter):
+    name = "mistral"
+
+    async def complete(self, prompt):
+        return await get_mistral_response(prompt)
+
+    def stream(self, prompt):
+        return stream_mistral_response(prompt)
+
+
+PROVIDERS = {
+    adapter.name: adapter
+    for adapter in (GeminiAdapter(), CohereAdapter(), MistralAdapter())
+}
+
+
+def get_provider(model_choice):
+    # /chat has always sent anything that isn't gemini/cohere to Mistral
+    return PROVIDERS.get(model_choice, PROVIDERS["mistral"])
 
 
 # =========================
-# Weather
+# Hedging & Fallback
 # =========================
-async def get_weather_data(city):
-    try:
-        async with httpx.AsyncClient() as client:
-            geo_resp = await client.get(
-                f"{API_BASE_URL}/weather",
-                params={"q": city, "appid": API_KEY, "units": temperatureUnit},
+# On errors a request falls through FALLBACK_ORDER until some provider
+# answers.  Hedging (opt-in: MISTAI_HEDGING=true or "hedge": true per
+# request) also races the next provider once the primary has been slower
+# than its own HEDGE_PERCENTILE latency.
+FALLBACK_ENABLED = os.getenv("MISTAI_FALLBACK", "true").lower() == "true"
+HEDGING_ENABLED = os.getenv("MISTAI_HEDGING", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("MISTAI_HEDGE_PERCENTILE", "0.9"))
+HEDGE_MIN_DELAY = 1.5  # seconds — never hedge faster than this
+HEDGE_DEFAULT_DELAY = 8.0  # until a provider has enough latency samples
+HEDGE_MIN_SAMPLES = 20
+
+FALLBACK_ORDER = {
+    "gemini": ["mistral", "cohere"],
+    "cohere": ["gemini", "mistral"],
+    "mistral": ["gemini", "cohere"],
+}
+
+
+class LatencyTracker:
+    """Recent successful completion latencies per provider."""
+
+    def __init__(self, window=200):
+        self._samples = {}
+        self._window = window
+        self._lock = threading.Lock()
+
+    def record(self, provider, seconds):
+        with self._lock:
+            self._samples.setdefault(provider, deque(maxlen=self._window)).append(
+                seconds
             )
-            geo_data = geo_resp.json()
-            if geo_data.get("cod") != 200:
-                return {"error": geo_data.get("message", "City not found.")}
-
-            lat = geo_data["coord"]["lat"]
-            lon = geo_data["coord"]["lon"]
-
-            one_call_resp = await client.get(
-                "https://api.openweathermap.org/data/3.0/onecall",
-                params={
-                    "lat": lat,
-                    "lon": lon,
-                    "exclude": "minutely,daily,alerts,current",
-                    "appid": API_KEY,
-                    "units": temperatureUnit,
-                },
+
+    def percentile(self, provider, q):
+        with self._lock:
+            samples = sorted(self._samples.get(provider, ()))
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(int(q * len(samples)), len(samples) - 1)]
+
+
+provider_latency = LatencyTracker()
+
+
+def provider_chain(primary):
+    if not FALLBACK_ENABLED:
+        return [primary]
+    return [primary] + [PROVIDERS[name] for name in FALLBACK_ORDER[primary.name]]
+
+
+async def timed_complete(adapter, prompt):
+    started = time.monotonic()
+    result = await BREAKERS[adapter.name].call(adapter.complete(prompt))
+    provider_latency.record(adapter.name, time.monotonic() - started)
+    return result
+
+
+def hedge_delay(provider):
+    observed = provider_latency.percentile(provider, HEDGE_PERCENTILE)
+    if observed is None:
+        return HEDGE_DEFAULT_DELAY
+    return max(observed, HEDGE_MIN_DELAY)
+
+
+async def complete_with_policy(primary, prompt, hedge=None):
+    """
+    Complete `prompt` starting with `primary`, falling back (and optionally
+    hedging) across providers.  Returns (text, name of the model that served it).
+    Losers of a hedge are cancelled; a provider call already running on a
+    worker thread finishes in the background and its result is dropped.
+    """
+    chain = provider_chain(primary)
+    hedge = HEDGING_ENABLED if hedge is None else hedge
+    last_error = None
+    running = {}  # task -> adapter
+    next_index = 0
+
+    def launch():
+        # Start the next provider whose breaker will take a call
+        nonlocal next_index, last_error
+        while next_index < len(chain):
+            adapter = chain[next_index]
+            next_index += 1
+            if BREAKERS[adapter.name].state == CircuitBreaker.OPEN:
+                last_error = CircuitOpenError(adapter.name)
+                continue
+            running[asyncio.ensure_future(timed_complete(adapter, prompt))] = adapter
+            return
+
+    launch()
+    try:
+        while running:
+            can_hedge = hedge and next_index < len(chain) and len(running) == 1
+            timeout = hedge_delay(chain[next_index - 1].name) if can_hedge else None
+            done, _ = await asyncio.wait(
+                running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
             )
-            one_call_data = one_call_resp.json()
+            if not done:
+                log_warn(f"⚠️ {chain[next_index - 1].name} is slow → hedging")
+                launch()
+                continue
+            for task in done:
+                adapter = running.pop(task)
+                try:
+                    text = task.result()
+                except Exception as e:
+                    last_error = e
+                    log_warn(f"⚠️ {adapter.name} failed: {type(e).__name__}: {e}")
+                    continue
+                if text:
+                    return text, adapter.name
+                last_error = RuntimeError(f"Empty response from {adapter.name}")
+            if not running and next_index < len(chain):
+                launch()
+    finally:
+        for task in running:
+            task.cancel()
+    raise last_error
+
+
+class FallbackStream:
+    """
+    Stream from the first provider in the chain that yields a token.
+    Fallback is only possible before the first token has been sent;
+    `model` names the provider that actually served the stream.
+    """
 
-            upcoming = []
-            for hour_data in one_call_data.get("hourly", [])[:6]:
-                timestamp = datetime.fromtimestamp(hour_data["dt"])
-                upcoming.append(
-                    {
-                        "hour": timestamp.strftime("%I:%M %p"),
-                        "temp": f"{round(hour_data['temp'])}",
-                        "desc": hour_data["weather"][0]["description"].capitalize(),
-                    }
-                )
+    def __init__(self, primary, prompt):
+        self.chain = provider_chain(primary)
+        self.prompt = prompt
+        self.model = primary.name
+
+    def __iter__(self):
+        last_error = None
+        for adapter in self.chain:
+            breaker = BREAKERS[adapter.name]
+            ticket = breaker.allow()
+            if not ticket:
+                last_error = CircuitOpenError(adapter.name)
+                continue
+            started = time.monotonic()
+            try:
+                chunks = iter(adapter.stream(self.prompt))
+                first = next(chunks)
+            except StopIteration:
+                breaker.record(False, time.monotonic() - started)
+                last_error = RuntimeError(f"Empty response from {adapter.name}")
+                continue
+            except Exception as e:
+                breaker.record(False, time.monotonic() - started)
+                last_error = e
+                log_warn(f"⚠️ {adapter.name} stream failed: {type(e).__name__}: {e}")
+                continue
+            # Breakers judge streams on time to first token
+            first_token = time.monotonic() - started
+            self.model = adapter.name
+            try:
+                yield first
+                yield from chunks
+            except GeneratorExit:
+                breaker.release(ticket)  # client went away — no verdict either way
+                raise
+            except Exception:
+                breaker.record(False, first_token)
+                raise
+            breaker.record(True, first_token)
+            return
+        raise last_error
 
-            return {
-                "temperature": f"{round(geo_data['main']['temp'])}°F",
-                "description": geo_data["weather"][0]["description"].capitalize(),
-                "hourly": upcoming,
+
+# =========================
+# Weather
+# =========================
+# City names resolve to coordinates once a week; forecasts are cached per
+# coordinates for a few minutes.  Concurrent lookups for the same city or
+# location share one upstream call.
+WEATHER_GEO_TTL = 7 * 24 * 60 * 60
+WEATHER_FORECAST_TTL = 10 * 60
+WEATHER_NOT_FOUND_TTL = 10 * 60
+WEATHER_LAST_CITY_TTL = 24 * 60 * 60
+WEATHER_ONECALL_URL = "https://api.openweathermap.org/data/3.0/onecall"
+
+weather_geo_cache = TTLCache(
+    "weather_geocode",
+    max_entries=2000,
+    max_bytes=256 * 1024,
+    default_ttl=WEATHER_GEO_TTL,
+)
+weather_forecast_cache = TTLCache(
+    "weather_forecast",
+    max_entries=500,
+    max_bytes=1024 * 1024,
+    default_ttl=WEATHER_FORECAST_TTL,
+)
+# client id -> city of their last /weather, so a bare "/weather" repeats it
+weather_last_city = TTLCache(
+    "weather_last_city",
+    max_entries=10000,
+    max_bytes=1024 * 1024,
+    default_ttl=WEATHER_LAST_CITY_TTL,
+)
+weather_flights = SingleFlight()
+
+
+class WeatherAPIError(Exception):
+    """OpenWeather answered with an error other than "not found" (401, 429...)."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def _openweather_fetch(url, params):
+    response = get_checked(get_http_client("openweather"), url, params=params)
+    if response.status_code not in (200, 404):
+        # raised inside the breaker, so a bad key or rate limit counts as a
+        # failure; the message is OpenWeather's, never the URL with the key
+        try:
+            message = response.json().get("message")
+        except ValueError:
+            message = None
+        raise WeatherAPIError(
+            response.status_code, message or "Weather data unavailable."
+        )
+    return response.json()
+
+
+async def openweather_get(url, **params):
+    return await BREAKERS["weather"].call(
+        asyncio.to_thread(
+            _openweather_fetch,
+            url,
+            {**params, "appid": API_KEY, "units": temperatureUnit},
+        )
+    )
+
+
+async def _geocode_city(key):
+    geo_data = await openweather_get(f"{API_BASE_URL}/weather", q=key)
+    if str(geo_data.get("cod")) == "404":
+        result = {"error": geo_data.get("message", "City not found.")}
+        weather_geo_cache.set(key, result, ttl=WEATHER_NOT_FOUND_TTL)
+        return result
+    if "coord" not in geo_data:
+        return {"error": geo_data.get("message", "Weather data unavailable.")}
+    result = {"lat": geo_data["coord"]["lat"], "lon": geo_data["coord"]["lon"]}
+    weather_geo_cache.set(key, result)
+    return result
+
+
+async def geocode_city(city):
+    """{"lat", "lon"} for a city name, or {"error"} if OpenWeather has none."""
+    key = " ".join(city.lower().split())
+    coords = weather_geo_cache.get(key)
+    if coords is None:
+        coords = await weather_flights.do(("geo", key), lambda: _geocode_city(key))
+    return coords
+
+
+async def _fetch_forecast(key):
+    lat, lon = key
+    one_call_data = await openweather_get(
+        WEATHER_ONECALL_URL, lat=lat, lon=lon, exclude="minutely,daily,alerts"
+    )
+    if "current" not in one_call_data:
+        # 401/429 raise WeatherAPIError; anything else without "current"
+        # is reported, not cached
+        log_warn(f"⚠️ OneCall error {one_call_data.get('cod')}: {one_call_data}")
+        return {"error": one_call_data.get("message", "Weather data unavailable.")}
+    current = one_call_data["current"]
+
+    upcoming = []
+    for hour_data in one_call_data.get("hourly", [])[:6]:
+        timestamp = datetime.fromtimestamp(hour_data["dt"])
+        upcoming.append(
+            {
+                "hour": timestamp.strftime("%I:%M %p"),
+                "temp": f"{round(hour_data['temp'])}",
+                "desc": hour_data["weather"][0]["description"].capitalize(),
             }
+        )
+
+    forecast = {
+        "temperature": f"{round(current['temp'])}°F",
+        "description": current["weather"][0]["description"].capitalize(),
+        "hourly": upcoming,
+    }
+    weather_forecast_cache.set(key, forecast)
+    return forecast
+
+
+async def get_forecast(lat, lon):
+    key = (round(lat, 2), round(lon, 2))  # ~1 km; nearby lookups share
+    forecast = weather_forecast_cache.get(key)
+    if forecast is None:
+        forecast = await weather_flights.do(
+            ("forecast", key), lambda: _fetch_forecast(key)
+        )
+    return forecast
+
+
+async def get_weather_data(city):
+    try:
+        coords = await geocode_city(city)
+        if "error" in coords:
+            return coords
+        return await get_forecast(coords["lat"], coords["lon"])
+    except CircuitOpenError:
+        return {"error": "Weather service is temporarily unavailable. Try again soon."}
+    except WeatherAPIError as e:
+        log_warn(f"⚠️ OpenWeather error {e.status}: {e}")
+        return {"error": str(e)}
     except Exception as e:
         log_err(f"❌ Weather API error: {e}")
         return {"error": str(e)}
@@ -1722,6 +4995,13 @@ def get_random_fun_fact():
     return random.choice(fun_facts)
 
 
+# Last, so everything startup()'s threads reach for is already defined.
+# gunicorn.conf.py preloads the app in the master and defers startup() to
+# each worker's post_fork, so no threads or pools exist before the fork.
+# Extraction workers re-running this file as __mp_main__ never start up.
+if os.getenv("MISTAI_DEFER_STARTUP") != "1" and __name__ != "__mp_main__":
+    startup()
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     log.info(f"🚀 Mist.AI Server is starting on 0.0.0.0:{port}...")
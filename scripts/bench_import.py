@@ -0,0 +1,117 @@
+"""
+Cold-start benchmark: time `import mistai` (which runs startup()) in fresh
+interpreters and fail when the median exceeds the budget.
+
+    python scripts/bench_import.py                # 5 runs, 1000 ms budget
+    python scripts/bench_import.py --runs 10 --budget-ms 1200 --top 15
+
+Missing API keys are filled with placeholders so the import succeeds; no
+network calls are made.  Prewarming is disabled so only the blocking part
+of startup is measured.  Exits 1 if over budget.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+REQUIRED_KEYS = [
+    "GEMINI_API_KEY",
+    "COHERE_API_KEY",
+    "OPENWEATHER_API_KEY",
+    "THE_NEWS_API_KEY",
+    "GOFLIE_API_KEY",
+    "MISTRAL_API_KEY",
+    "ADMIN_USERNAME",
+    "ADMIN_PASSWORD",
+    "FLASK_SECRET_KEY",
+    "TAVILY_API_KEY",
+]
+
+TIMER = (
+    "import time; t = time.perf_counter(); import mistai; "
+    "print('IMPORT_MS', (time.perf_counter() - t) * 1000)"
+)
+
+
+def bench_env():
+    env = dict(os.environ)
+    for key in REQUIRED_KEYS:
+        env.setdefault(key, "bench-placeholder")
+    env["MISTAI_PREWARM"] = "false"
+    env["METRICS_PORT"] = "0"  # any free port
+    env["PYTHONPATH"] = REPO_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def run_once(env, workdir, importtime=False):
+    cmd = [sys.executable]
+    if importtime:
+        cmd += ["-X", "importtime"]
+    cmd += ["-c", TIMER]
+    proc = subprocess.run(
+        cmd, env=env, cwd=workdir, capture_output=True, text=True, timeout=120
+    )
+    if proc.returncode != 0:
+        sys.exit(f"import mistai failed:\n{proc.stderr[-2000:]}")
+    for line in proc.stdout.splitlines():
+        if line.startswith("IMPORT_MS"):
+            return float(line.split()[1]), proc.stderr
+    sys.exit("benchmark child printed no timing")
+
+
+def heaviest_imports(importtime_log, top):
+    """Top-level packages by cumulative import time (µs) from -X importtime."""
+    totals = {}
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        try:
+            _, cumulative, name = [part.strip() for part in line[12:].split("|")]
+            cumulative = int(cumulative)
+        except ValueError:
+            continue  # header row
+        root = name.split(".")[0]
+        # the outermost entry of a package carries its full cumulative time
+        totals[root] = max(totals.get(root, 0), cumulative)
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=float(os.getenv("STARTUP_BUDGET_MS", "1000")),
+    )
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    env = bench_env()
+    with tempfile.TemporaryDirectory() as workdir:  # chat logs / bans.db land here
+        run_once(env, workdir)  # warm the OS page cache, not counted
+        samples = [run_once(env, workdir)[0] for _ in range(args.runs)]
+        _, importtime_log = run_once(env, workdir, importtime=True)
+
+    median = statistics.median(samples)
+    print(f"import mistai: median {median:.0f} ms over {args.runs} runs")
+    print(f"  min {min(samples):.0f} ms, max {max(samples):.0f} ms")
+    print("heaviest imports:")
+    for name, micros in heaviest_imports(importtime_log, args.top):
+        print(f"  {name:<28} {micros / 1000:8.1f} ms")
+
+    if median > args.budget_ms:
+        print(f"❌ over budget: {median:.0f} ms > {args.budget_ms:.0f} ms")
+        return 1
+    print(f"✅ within budget ({args.budget_ms:.0f} ms)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""
+Microbenchmark: classify extension prompts with the precompiled template
+classifier versus the old per-request `re.sub` chain, on large inputs.
+
+    python scripts/bench_templates.py                 # 200 KB pages, 200 rounds
+    python scripts/bench_templates.py --page-kb 1000 --rounds 50
+
+Missing API keys are filled with placeholders and startup() is skipped, so
+importing mistai makes no network calls; the data directory it creates at
+import goes to a temporary directory that is removed afterwards.
+"""
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+import timeit
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from bench_import import REQUIRED_KEYS  # noqa: E402
+
+for _key in REQUIRED_KEYS:
+    os.environ.setdefault(_key, "bench-placeholder")
+os.environ["MISTAI_DEFER_STARTUP"] = "1"
+os.environ["METRICS_PORT"] = "0"
+
+# mistai creates data/chat_logs under the working directory at import
+_cwd = os.getcwd()
+with tempfile.TemporaryDirectory(prefix="mistai-bench-") as _scratch:
+    os.chdir(_scratch)
+    try:
+        import mistai  # noqa: E402
+    finally:
+        os.chdir(_cwd)
+
+# The chain clean_log_message used to build inside chat() on every request
+LEGACY_PATTERNS = [
+    (r'You are a knowledgeable assistant.*?Question:\s*"(.+?)".*', r"[Quiz] \1"),
+    (r'You are filling out a web form.*?labeled:\s*"(.+?)".*', r"[Fill field] \1"),
+    (r'You are an AI form-filling assistant.*?on "(.+?)".*', r"[Auto-fill] \1"),
+    (r'Improve the writing of this text.*?:\s*"(.+?)".*', r"[Improve] \1"),
+    (r'Rephrase this more clearly.*?:\s*"(.+?)".*', r"[Rephrase] \1"),
+    (r'Summarize this.*?:\s*"(.+?)".*', r"[Summarize] \1"),
+    (r'Explain this in simple terms.*?:\s*"(.+?)".*', r"[Explain] \1"),
+    (r'Translate this to English.*?:\s*"(.+?)".*', r"[Translate] \1"),
+    (r"Summarize this web page.*", "[Page summarize]"),
+    (r"Explain what this web page.*", "[Page explain]"),
+]
+
+
+def legacy_clean(msg):
+    for pattern, replacement in LEGACY_PATTERNS:
+        cleaned = re.sub(pattern, replacement, msg, flags=re.DOTALL | re.IGNORECASE)
+        if cleaned != msg:
+            return cleaned[:120]
+    return msg[:120]
+
+
+def sample_inputs(page_kb):
+    paragraph = (
+        "Lorem ipsum dolor sit amet, consectetur adipiscing elit. Sed do "
+        "eiusmod tempor incididunt ut labore et dolore magna aliqua.\n"
+    )
+    page = (paragraph * (page_kb * 1024 // len(paragraph) + 1))[: page_kb * 1024]
+    return {
+        "page_summarize": f"Summarize this web page content concisely:\n\n{page}",
+        "page_explain": f"Explain what this web page is about:\n\n{page}",
+        "auto_fill": f'You are an AI form-filling assistant on "Signup".\n\n{page}',
+        "summarize": f'Summarize this:\n\n"{page}"',
+        "chat": f"Can you help me with this?\n\n{page}",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--page-kb", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{args.page_kb} KB inputs, {args.rounds} rounds (µs per message)")
+    print(f"  {'template':<16} {'legacy':>12} {'classifier':>12} {'speedup':>9}")
+    for name, msg in sample_inputs(args.page_kb).items():
+        template_id, _ = mistai.classify_prompt(msg)
+        if template_id != name:
+            sys.exit(f"❌ {name}: classified as {template_id}")
+        legacy = timeit.timeit(lambda msg=msg: legacy_clean(msg), number=args.rounds)
+        current = timeit.timeit(
+            lambda msg=msg: mistai.clean_log_message(msg), number=args.rounds
+        )
+        legacy_us = legacy / args.rounds * 1e6
+        current_us = current / args.rounds * 1e6
+        print(
+            f"  {name:<16} {legacy_us:12.1f} {current_us:12.1f} "
+            f"{legacy_us / current_us:8.0f}x"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
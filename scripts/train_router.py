@@ -0,0 +1,219 @@
+"""
+Train and evaluate the local search router (mistai.LocalRouter) from the
+chat logs.
+
+    python scripts/train_router.py train            # writes ROUTER_MODEL_PATH
+    python scripts/train_router.py eval             # holdout report, current model
+    python scripts/train_router.py train --logs /app/data/chat_logs --out m.npz
+    python scripts/train_router.py eval --band 0.1 0.9
+
+Labels are the Cohere router's decisions ("router": {"source": "model"}).
+Decisions made by the local model, the router cache, the heuristics or a
+forced "ground" are the router's own outputs and are skipped, as are
+responses served from the response cache.  Entries written before the
+first one that records a "router" predate the local router; for those the
+"grounded" flag is the label.
+Extension templates, image messages and messages the _quick_no heuristic
+answers are skipped — the router never sees those.  A fixed 20% of
+messages (by hash) is held out of training and used for evaluation.
+Running servers pick up a new model file within ROUTER_RELOAD_CHECK.
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import zlib
+from datetime import datetime
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from bench_import import REQUIRED_KEYS  # noqa: E402
+
+for _key in REQUIRED_KEYS:
+    os.environ.setdefault(_key, "train-placeholder")
+os.environ["MISTAI_DEFER_STARTUP"] = "1"
+os.environ["METRICS_PORT"] = "0"
+
+import mistai  # noqa: E402
+
+HOLDOUT_BUCKETS = 5  # 1 in 5 messages is held out
+_TEMPLATE_LABEL = re.compile(r"^\[[A-Z][\w -]*\]")  # "[Summarize] ..." log form
+
+
+def load_examples(log_dir):
+    """[(text, label, source, router_ms)], one per distinct message (latest)."""
+    store = mistai.ChatLogStore(log_dir, 0, 0, gzip_closed=False)
+    entries = list(store.iter_entries())
+    # entries from before the local router never recorded a "router"
+    router_since = min(
+        (e.get("timestamp", "") for e in entries if e.get("router")), default=None
+    )
+    examples = {}
+    for entry in sorted(entries, key=lambda e: e.get("timestamp", "")):
+        text = (entry.get("message") or "").strip()
+        if entry.get("template", "chat") != "chat" or _TEMPLATE_LABEL.match(text):
+            continue
+        if "\n[Image:" in text or mistai._quick_no(text):
+            continue
+        router = entry.get("router")
+        if router:
+            if router.get("source") != "model":
+                continue  # local, cache, heuristic: the router grading itself
+            label, source = router["decision"] == "YES", "model"
+        elif router_since is None or entry.get("timestamp", "") < router_since:
+            if "grounded" not in entry:
+                continue
+            label, source = bool(entry["grounded"]), "grounded"
+        else:
+            continue  # response cache hit or forced grounding
+        router_ms = (entry.get("timings") or {}).get("router")
+        examples[" ".join(text.lower().split())] = (text, label, source, router_ms)
+    return list(examples.values())
+
+
+def is_holdout(text):
+    key = " ".join(text.lower().split()).encode("utf-8")
+    return zlib.crc32(key) % HOLDOUT_BUCKETS == 0
+
+
+def featurize(texts):
+    """Stack router_features into COO arrays: (rows, cols, values)."""
+    rows, cols, values = [], [], []
+    for row, text in enumerate(texts):
+        indices, vals = mistai.router_features(text)
+        rows.append(np.full(len(indices), row, dtype=np.int64))
+        cols.append(indices)
+        values.append(vals)
+    if not texts:
+        empty = np.zeros(0)
+        return empty.astype(np.int64), empty.astype(np.int64), empty
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(values)
+
+
+def predict(weights, bias, features, n):
+    rows, cols, values = features
+    logits = bias + np.bincount(rows, weights=weights[cols] * values, minlength=n)
+    return 1.0 / (1.0 + np.exp(-logits))
+
+
+def train(features, labels, epochs, lr, l2):
+    """Full-batch Adam on L2-regularized log loss."""
+    rows, cols, values = features
+    n, dim = len(labels), mistai.ROUTER_FEATURE_DIM
+    params = np.zeros(dim + 1)  # weights..., bias
+    m, v = np.zeros_like(params), np.zeros_like(params)
+    beta1, beta2, eps = 0.9, 0.999, 1e-8
+    for step in range(1, epochs + 1):
+        error = predict(params[:dim], params[dim], features, n) - labels
+        grad = np.empty_like(params)
+        grad[:dim] = np.bincount(cols, weights=error[rows] * values, minlength=dim)
+        grad[:dim] = grad[:dim] / n + l2 * params[:dim]
+        grad[dim] = error.mean()
+        m = beta1 * m + (1 - beta1) * grad
+        v = beta2 * v + (1 - beta2) * grad**2
+        m_hat = m / (1 - beta1**step)
+        v_hat = v / (1 - beta2**step)
+        params -= lr * m_hat / (np.sqrt(v_hat) + eps)
+    return params[:dim].astype(np.float32), float(params[dim])
+
+
+def report(examples, weights, bias, band):
+    low, high = band
+    texts = [e[0] for e in examples]
+    labels = np.array([e[1] for e in examples], dtype=bool)
+    if not texts:
+        print("no holdout examples")
+        return
+    scores = predict(weights, bias, featurize(texts), len(texts))
+    confident = (scores <= low) | (scores >= high)
+    decisions = scores >= 0.5
+    agree = decisions == labels
+    teacher = np.array([e[2] == "model" for e in examples])
+
+    print(f"holdout: {len(texts)} messages ({labels.mean():.0%} need search)")
+    print(f"  agreement at 0.5:            {agree.mean():.1%}")
+    if teacher.any():
+        print(f"  agreement with Cohere router: {agree[teacher].mean():.1%}")
+    print(f"  decided locally (band {low}-{high}): {confident.mean():.1%}")
+    if confident.any():
+        print(f"  agreement when decided locally: {agree[confident].mean():.1%}")
+
+    started = time.perf_counter()
+    for text in texts:
+        indices, values = mistai.router_features(text)
+        bias + float(np.dot(weights[indices], values))
+    local_us = (time.perf_counter() - started) / len(texts) * 1e6
+
+    router_ms = [e[3] for e in examples if e[2] == "model" and e[3] is not None]
+    print(f"  local inference: {local_us:.1f} µs/message")
+    if router_ms:
+        cohere_ms = float(np.median(router_ms))
+        saved = confident.mean() * (cohere_ms - local_us / 1000)
+        print(f"  Cohere router:   {cohere_ms:.0f} ms median (from logged timings)")
+        print(f"  latency saved:   {saved:.0f} ms per routed message on average")
+    else:
+        print("  no logged Cohere router timings — latency saved unknown")
+
+
+def load_model(path):
+    with np.load(path) as model:
+        return model["weights"], float(model["bias"]), json.loads(str(model["info"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("command", choices=["train", "eval"])
+    parser.add_argument("--logs", default=mistai.LOG_SEGMENT_DIR)
+    parser.add_argument("--out", default=mistai.ROUTER_MODEL_PATH)
+    parser.add_argument(
+        "--band",
+        nargs=2,
+        type=float,
+        default=[mistai.ROUTER_BAND_LOW, mistai.ROUTER_BAND_HIGH],
+    )
+    parser.add_argument("--epochs", type=int, default=300)
+    parser.add_argument("--lr", type=float, default=0.05)
+    parser.add_argument("--l2", type=float, default=1e-4)
+    parser.add_argument("--min-examples", type=int, default=200)
+    args = parser.parse_args()
+
+    examples = load_examples(args.logs)
+    training = [e for e in examples if not is_holdout(e[0])]
+    holdout = [e for e in examples if is_holdout(e[0])]
+    print(f"{len(examples)} labelled messages in {args.logs}")
+
+    if args.command == "eval":
+        if not os.path.exists(args.out):
+            sys.exit(f"❌ no model at {args.out} — run `train` first")
+        weights, bias, info = load_model(args.out)
+        print(f"model: {info}")
+        report(holdout, weights, bias, args.band)
+        return 0
+
+    if len(training) < args.min_examples:
+        sys.exit(f"❌ {len(training)} training examples, need {args.min_examples}")
+    labels = np.array([e[1] for e in training], dtype=np.float64)
+    texts = [e[0] for e in training]
+    weights, bias = train(featurize(texts), labels, args.epochs, args.lr, args.l2)
+    info = {
+        "trained_at": datetime.now().isoformat(),
+        "examples": len(training),
+        "positives": int(labels.sum()),
+        "feature_dim": mistai.ROUTER_FEATURE_DIM,
+    }
+    tmp = args.out + ".tmp.npz"
+    np.savez_compressed(tmp, weights=weights, bias=bias, info=json.dumps(info))
+    os.replace(tmp, args.out)  # servers never load a half-written file
+    print(f"✅ wrote {args.out}")
+    report(holdout, weights, bias, args.band)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
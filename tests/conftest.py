@@ -0,0 +1,26 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, "scripts"))
+
+from bench_import import REQUIRED_KEYS  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def mistai(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as mp:
+        for key in REQUIRED_KEYS:
+            mp.setenv(key, os.environ.get(key, "test-placeholder"))
+        # no startup(): no metrics port, background threads or provider probes
+        mp.setenv("MISTAI_DEFER_STARTUP", "1")
+        mp.setenv("METRICS_PORT", "0")
+        mp.setenv("MISTAI_PREWARM", "false")
+        # mistai creates its data directory and databases under the working
+        # directory at import time
+        mp.chdir(tmp_path_factory.mktemp("mistai"))
+        yield importlib.import_module("mistai")
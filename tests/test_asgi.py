@@ -0,0 +1,61 @@
+import asyncio
+import importlib
+import json
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def application(mistai):
+    return importlib.import_module("asgi").application
+
+
+def call(application, method, path, body=b"", headers=()):
+    messages = []
+    request = [{"type": "http.request", "body": body}]
+
+    async def receive():
+        return request.pop(0)
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": b"",
+        "http_version": "1.1",
+        "headers": [(b"host", b"localhost"), *headers],
+        "client": ("127.0.0.1", 40000),
+    }
+    asyncio.run(application(scope, receive, send))
+    start, *bodies = messages
+    assert start["type"] == "http.response.start"
+    assert bodies[-1] == {"type": "http.response.body"}
+    return start, bodies[:-1]
+
+
+def test_plain_response(application):
+    start, bodies = call(application, "GET", "/api/status")
+
+    assert start["status"] == 200
+    payload = json.loads(b"".join(m["body"] for m in bodies))
+    assert payload["status"] == "online"
+
+
+def test_streamed_response(application):
+    start, bodies = call(
+        application,
+        "POST",
+        "/chat",
+        json.dumps({"message": "fun fact", "stream": True}).encode(),
+        [(b"content-type", b"application/json")],
+    )
+
+    assert start["status"] == 200
+    assert (b"content-type", b"text/event-stream") in [
+        (name, value.split(b";")[0]) for name, value in start["headers"]
+    ]
+    assert all(m.get("more_body") for m in bodies)
+    assert b"event: done" in b"".join(m["body"] for m in bodies)
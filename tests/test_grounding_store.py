@@ -0,0 +1,16 @@
+import time
+
+
+def test_compaction_empties_the_freelist(mistai, tmp_path, monkeypatch):
+    store = mistai.GroundingStore(str(tmp_path / "grounding.db"), 1024 * 1024)
+    store.open()
+    for i in range(200):
+        store.put(f"key{i}", f"query {i}", "x" * 4000, "general", ttl=60)
+    later = time.time() + 120
+    monkeypatch.setattr(mistai.time, "time", lambda: later)
+
+    store.compact()
+
+    conn = store._conn
+    assert conn.execute("SELECT COUNT(*) FROM grounding").fetchone()[0] == 0
+    assert conn.execute("PRAGMA freelist_count").fetchone()[0] == 0
@@ -0,0 +1,44 @@
+PAGE = (
+    "Summarize this web page for me.\n\n"
+    "Today the city council met to discuss the latest budget for 2025."
+)
+
+
+def test_page_summary_mentioning_today_is_cached(mistai, monkeypatch):
+    calls = []
+
+    async def run_pregeneration(*args):
+        return None, ""
+
+    async def complete_with_policy(provider, prompt, hedge=None):
+        calls.append(prompt)
+        return "The council discussed the budget.", provider.name
+
+    monkeypatch.setattr(mistai, "run_pregeneration", run_pregeneration)
+    monkeypatch.setattr(mistai, "complete_with_policy", complete_with_policy)
+    monkeypatch.setattr(mistai, "safe_log_chat", lambda *a, **k: None)
+    monkeypatch.setattr(
+        mistai,
+        "response_cache",
+        mistai.ResponseCache(
+            mistai.RESPONSE_CACHE_MAX_ENTRIES,
+            mistai.RESPONSE_CACHE_MAX_BYTES,
+            False,
+            mistai.RESPONSE_CACHE_SIMILARITY,
+        ),
+    )
+
+    client = mistai.app.test_client()
+    first = client.post("/chat", json={"message": PAGE, "model": "gemini"})
+    second = client.post("/chat", json={"message": PAGE, "model": "gemini"})
+
+    assert first.get_json()["response"] == "The council discussed the budget."
+    assert second.get_json()["cached"] is True
+    assert len(calls) == 1
+
+
+def test_typed_question_about_today_is_not_cached(mistai):
+    assert mistai.prompt_time_sensitive(
+        "what day is it today?", mistai.classify_prompt("what day is it today?")
+    )
+    assert not mistai.prompt_time_sensitive(PAGE, mistai.classify_prompt(PAGE))
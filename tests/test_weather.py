@@ -0,0 +1,40 @@
+import asyncio
+
+import httpx
+
+
+def fake_openweather(monkeypatch, mistai, status, body):
+    calls = []
+
+    def get_checked(client, url, **kwargs):
+        calls.append(kwargs["params"]["q"])
+        return httpx.Response(status, json=body)
+
+    monkeypatch.setattr(mistai, "get_checked", get_checked)
+    return calls
+
+
+def test_rate_limited_geocode_is_not_cached(mistai, monkeypatch):
+    calls = fake_openweather(
+        monkeypatch, mistai, 429, {"cod": 429, "message": "rate limited"}
+    )
+    failures = mistai.BREAKERS["weather"].snapshot()["failure_rate"]
+
+    first = asyncio.run(mistai.get_weather_data("Ratelimitville"))
+    second = asyncio.run(mistai.get_weather_data("Ratelimitville"))
+
+    assert first == second == {"error": "rate limited"}
+    assert len(calls) == 2
+    assert mistai.BREAKERS["weather"].snapshot()["failure_rate"] > failures
+
+
+def test_unknown_city_is_cached(mistai, monkeypatch):
+    calls = fake_openweather(
+        monkeypatch, mistai, 404, {"cod": "404", "message": "city not found"}
+    )
+
+    first = asyncio.run(mistai.get_weather_data("Nowhereville"))
+    second = asyncio.run(mistai.get_weather_data("Nowhereville"))
+
+    assert first == second == {"error": "city not found"}
+    assert len(calls) == 1
@@ -1,5 +1,6 @@
-from mistai import app
-application = app
+if __name__ != "__mp_main__":  # extraction workers re-run this script
+    from mistai import app
+    application = app
 
 if __name__ == "__main__":
     # For production, use gunicorn instead of Flask's built-in server